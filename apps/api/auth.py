@@ -1,17 +1,61 @@
 """Authentication and authorization utilities."""
 
 import time
+from collections import OrderedDict
 from typing import Optional, Dict, Any
 from fastapi import HTTPException, status, Depends, Request
+from fastapi.requests import HTTPConnection
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import JWTError, jwt
 
+import metrics
 from config import settings
 from models import Battle
 
 security = HTTPBearer()
 
 
+class VerifiedTokenCache:
+    """Bounded LRU of event tokens whose signature has already been checked.
+    
+    A venue uses one event token for the whole night, so after the first vote
+    verifying it again is a dictionary lookup. Entries are only served until the
+    token's `exp`; unseen tokens always go through the full signature check.
+    """
+    
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+    
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        """Get the payload of an already-verified, unexpired token."""
+        payload = self._entries.get(token)
+        if payload is not None:
+            exp = payload.get("exp")
+            if exp is None or exp > time.time():
+                self._entries.move_to_end(token)
+                metrics.token_cache_lookups_total.inc("hit")
+                return payload
+            del self._entries[token]
+        metrics.token_cache_lookups_total.inc("miss")
+        return None
+    
+    def put(self, token: str, payload: Dict[str, Any]) -> None:
+        """Remember a token that passed verification."""
+        if self.max_size <= 0:
+            return
+        self._entries[token] = payload
+        self._entries.move_to_end(token)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+token_cache = VerifiedTokenCache(settings.token_cache_size)
+
+
 def create_event_token(event_id: str, expires_in: int = None) -> str:
     """Create a signed event token."""
     if expires_in is None:
@@ -28,9 +72,14 @@ def create_event_token(event_id: str, expires_in: int = None) -> str:
 
 def verify_event_token(token: str) -> Dict[str, Any]:
     """Verify and decode event token."""
+    payload = token_cache.get(token)
+    if payload is not None:
+        return dict(payload)
+    
     try:
         payload = jwt.decode(token, settings.signing_secret, algorithms=["HS256"])
-        return payload
+        token_cache.put(token, payload)
+        return dict(payload)
     except JWTError as e:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -54,8 +103,8 @@ async def verify_admin_key(request: Request) -> None:
         )
 
 
-def get_client_ip(request: Request) -> str:
-    """Get client IP address from request."""
+def get_client_ip(request: HTTPConnection) -> str:
+    """Get client IP address from a request or WebSocket."""
     # Check for forwarded headers first (for reverse proxies)
     forwarded_for = request.headers.get("X-Forwarded-For")
     if forwarded_for:
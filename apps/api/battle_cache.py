@@ -0,0 +1,220 @@
+"""Per-process battle metadata cache.
+
+`/vote`, `/battles/{id}`, the SSE stream and the QR endpoints all need a battle's
+row on every request, yet it only changes when an admin acts on it. Battles (and
+the events they belong to) are cached in a bounded in-memory LRU; the admin
+endpoints broadcast invalidations over Redis so every worker drops its copy,
+and a TTL bounds staleness if a broadcast is ever missed. Unknown ids are
+remembered only briefly, so probing random ids cannot fill the cache.
+"""
+
+import asyncio
+import json
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from functools import cached_property
+from typing import Any, Dict, Optional, Tuple, Union
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from database import AsyncSessionLocal
+from http_cache import content_etag
+from hub import pubsub_hub
+from models import Battle, BattleStatus, Event
+from redis_client import redis_client
+from schemas import BattleResponse
+
+INVALIDATION_CHANNEL = "battles:invalidate"
+
+
+@dataclass(frozen=True)
+class BattleInfo:
+    """Cached copy of a battle row."""
+    id: uuid.UUID
+    event_id: uuid.UUID
+    mc_a: str
+    mc_b: str
+    starts_at: datetime
+    ends_at: datetime
+    status: BattleStatus
+
+    @classmethod
+    def from_model(cls, battle: Battle) -> "BattleInfo":
+        return cls(
+            id=battle.id,
+            event_id=battle.event_id,
+            mc_a=battle.mc_a,
+            mc_b=battle.mc_b,
+            starts_at=battle.starts_at,
+            ends_at=battle.ends_at,
+            status=battle.status,
+        )
+
+    @cached_property
+    def etag(self) -> str:
+        return content_etag(BattleResponse.model_validate(self).model_dump_json().encode())
+
+
+@dataclass(frozen=True)
+class EventInfo:
+    """Cached copy of an event row."""
+    id: uuid.UUID
+    name: str
+    created_at: datetime
+
+    @classmethod
+    def from_model(cls, event: Event) -> "EventInfo":
+        return cls(id=event.id, name=event.name, created_at=event.created_at)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": str(self.id),
+            "name": self.name,
+            "created_at": self.created_at.isoformat()
+        }
+
+    @cached_property
+    def etag(self) -> str:
+        return content_etag(json.dumps(self.to_dict(), sort_keys=True).encode())
+
+
+CachedRow = Union[BattleInfo, EventInfo]
+# ("battle" | "event", id)
+_Key = Tuple[str, str]
+
+
+def _canonical(row_id: Any) -> Optional[str]:
+    """A row id as Postgres spells it, or None if it isn't a UUID."""
+    try:
+        return str(uuid.UUID(str(row_id)))
+    except ValueError:
+        return None
+
+
+class BattleCache:
+    """Battle and event lookups served from memory, invalidated across workers via Redis."""
+
+    def __init__(self, ttl: float, miss_ttl: float, max_size: int):
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[_Key, Tuple[Optional[CachedRow], float]]" = OrderedDict()
+        self._loading: Dict[_Key, asyncio.Future] = {}
+        self._generation = 0
+        # Identifies this worker's own broadcasts, which it has already applied
+        self._origin = uuid.uuid4().hex
+
+    async def get(self, battle_id: str, db: Optional[AsyncSession] = None) -> Optional[BattleInfo]:
+        """Get a battle, or None if it doesn't exist."""
+        return await self._get("battle", battle_id, db)
+
+    async def get_event(self, event_id: str, db: Optional[AsyncSession] = None) -> Optional[EventInfo]:
+        """Get an event, or None if it doesn't exist."""
+        return await self._get("event", event_id, db)
+
+    async def _get(self, kind: str, row_id: str, db: Optional[AsyncSession]) -> Optional[CachedRow]:
+        row_id = _canonical(row_id)
+        if row_id is None:
+            return None
+        key = (kind, row_id)
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[1] > asyncio.get_running_loop().time():
+                self._entries.move_to_end(key)
+                return entry[0]
+            del self._entries[key]
+
+        # Let concurrent misses share one query
+        loading = self._loading.get(key)
+        if loading is not None:
+            return await asyncio.shield(loading)
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+        try:
+            generation = self._generation
+            row = await self._load(key, db)
+            # An invalidation during the load may mean we read stale data
+            if generation == self._generation:
+                self._put(key, row)
+            future.set_result(row)
+            return row
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark retrieved so waiter-less failures aren't logged as unhandled
+            future.exception()
+            raise
+        finally:
+            del self._loading[key]
+
+    def _put(self, key: _Key, row: Optional[CachedRow]) -> None:
+        ttl = self.ttl if row is not None else self.miss_ttl
+        if self.max_size <= 0 or ttl <= 0:
+            return
+        self._entries[key] = (row, asyncio.get_running_loop().time() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def _load(self, key: _Key, db: Optional[AsyncSession]) -> Optional[CachedRow]:
+        if db is None:
+            async with AsyncSessionLocal() as session:
+                return await self._load(key, session)
+        kind, row_id = key
+        if kind == "event":
+            result = await db.execute(select(Event).filter(Event.id == row_id))
+            event = result.scalars().first()
+            return EventInfo.from_model(event) if event else None
+        result = await db.execute(select(Battle).filter(Battle.id == row_id))
+        battle = result.scalars().first()
+        return BattleInfo.from_model(battle) if battle else None
+
+    def invalidate(self, battle_id: Optional[str] = None, event_id: Optional[str] = None) -> None:
+        """Drop cached rows, by battle id or an event along with all its battles."""
+        self._generation += 1
+        battle_id, event_id = _canonical(battle_id), _canonical(event_id)
+        if battle_id is not None:
+            self._entries.pop(("battle", battle_id), None)
+        if event_id is not None:
+            self._entries.pop(("event", event_id), None)
+            for key, (row, _) in list(self._entries.items()):
+                if isinstance(row, BattleInfo) and str(row.event_id) == event_id:
+                    del self._entries[key]
+
+    async def broadcast_invalidation(
+        self, battle_id: Optional[str] = None, event_id: Optional[str] = None
+    ) -> None:
+        """Invalidate locally and tell the other workers to do the same."""
+        self.invalidate(battle_id=battle_id, event_id=event_id)
+        message = {
+            "origin": self._origin,
+            "battle_id": _canonical(battle_id),
+            "event_id": _canonical(event_id),
+        }
+        await redis_client.redis.publish(INVALIDATION_CHANNEL, json.dumps(message))
+
+    async def listen_for_invalidations(self) -> None:
+        """Apply invalidations broadcast by other workers until cancelled."""
+        async with pubsub_hub.subscribe(INVALIDATION_CHANNEL) as messages:
+            while True:
+                _, data = await messages.get()
+                try:
+                    message = json.loads(data)
+                except ValueError:
+                    continue
+                if message.get("origin") == self._origin:
+                    continue
+                self.invalidate(battle_id=message.get("battle_id"), event_id=message.get("event_id"))
+
+
+# Global battle cache instance
+battle_cache = BattleCache(
+    ttl=settings.battle_cache_ttl,
+    miss_ttl=settings.battle_cache_miss_ttl,
+    max_size=settings.battle_cache_size,
+)
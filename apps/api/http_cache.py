@@ -0,0 +1,33 @@
+"""HTTP caching helpers (ETags and conditional requests)."""
+
+import hashlib
+from typing import Optional
+
+from fastapi import Request, Response, status
+
+
+def content_etag(content: bytes) -> str:
+    """Strong ETag derived from a response body."""
+    return f'"{hashlib.sha256(content).hexdigest()[:32]}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Whether the request's If-None-Match already names `etag`."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in tags or etag in tags
+
+
+def cache_headers(etag: str, max_age: int, shared_max_age: Optional[int] = None) -> dict:
+    """ETag and Cache-Control headers for a public, revalidatable response."""
+    cache_control = f"public, max-age={max_age}"
+    if shared_max_age is not None:
+        cache_control += f", s-maxage={shared_max_age}"
+    return {"ETag": etag, "Cache-Control": cache_control}
+
+
+def not_modified(headers: dict) -> Response:
+    """A 304 response carrying the current validators."""
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
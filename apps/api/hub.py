@@ -0,0 +1,231 @@
+"""Per-process fan-out of Redis pub/sub messages.
+
+Each SSE viewer used to open its own Redis connection and subscription. The hub
+keeps a single pub/sub connection per worker process, subscribes to a channel
+when its first local listener arrives, unsubscribes when the last one leaves,
+and copies every message into the listeners' in-memory queues. A subscription
+returns only once Redis has confirmed it, so anything published afterwards is
+delivered. If the connection drops, the hub opens a new one and resubscribes
+every channel still in use.
+
+Live streams subscribe with a `LatestQueue`, which holds at most one pending
+message per key: a viewer that reads slowly gets the newest tally, never a
+growing backlog of stale ones.
+"""
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+import metrics
+from config import settings
+from redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+# (channel, data) pairs delivered to subscribers
+Message = Tuple[str, str]
+
+
+class LatestQueue:
+    """Per-subscriber buffer that keeps only the newest pending message per key.
+    
+    Messages are keyed by channel unless `key(channel, data)` says otherwise. A
+    message replaces an unread one with the same key, so memory stays bounded by
+    the number of keys however far the reader falls behind.
+    """
+
+    def __init__(self, key: Optional[Callable[[str, str], Hashable]] = None):
+        self._key = key
+        self._pending: Dict[Hashable, Message] = {}
+        self._ready = asyncio.Event()
+        self.buffered_bytes = 0
+
+    def put_nowait(self, message: Message) -> None:
+        channel, data = message
+        key = channel if self._key is None else self._key(channel, data)
+        # The replacement moves to the back, so messages still come out in arrival order
+        superseded = self._pending.pop(key, None)
+        if superseded is not None:
+            self.buffered_bytes -= len(superseded[1])
+            metrics.stream_messages_superseded_total.inc()
+        self._pending[key] = message
+        self.buffered_bytes += len(data)
+        self._ready.set()
+
+    async def get(self) -> Message:
+        while not self._pending:
+            self._ready.clear()
+            await self._ready.wait()
+        message = self._pending.pop(next(iter(self._pending)))
+        self.buffered_bytes -= len(message[1])
+        return message
+
+    def qsize(self) -> int:
+        return len(self._pending)
+
+
+class PubSubHub:
+    """Shares one Redis pub/sub connection between all local subscribers."""
+
+    def __init__(self):
+        self._pubsub = None
+        self._reader: Optional[asyncio.Task] = None
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._lock = asyncio.Lock()
+        self._reconnect_needed = False
+        # Channels whose SUBSCRIBE Redis has not confirmed yet
+        self._confirmations: Dict[str, asyncio.Future] = {}
+        # Confirmations still due for channels dropped before theirs arrived
+        self._stale_confirmations: Dict[str, int] = {}
+
+    @asynccontextmanager
+    async def subscribe(
+        self, *channels: str, queue: Optional[asyncio.Queue] = None
+    ) -> AsyncIterator[asyncio.Queue]:
+        """Yield a queue receiving (channel, data) for every message on `channels`.
+        
+        Every message published after this enters is delivered. Pass `queue` to
+        feed more channels into a queue from an earlier subscription.
+        """
+        if queue is None:
+            queue = asyncio.Queue()
+        await self._add(queue, channels)
+        try:
+            yield queue
+        finally:
+            await self._remove(queue, channels)
+
+    async def _add(self, queue: asyncio.Queue, channels: Tuple[str, ...]) -> None:
+        async with self._lock:
+            new_channels = [channel for channel in channels if channel not in self._subscribers]
+            if self._pubsub is None:
+                self._pubsub = redis_client.redis.pubsub()
+            # Register only once SUBSCRIBE is sent, so a failed send leaves no
+            # channel that looks subscribed but never receives anything
+            if new_channels:
+                await self._pubsub.subscribe(*new_channels)
+                loop = asyncio.get_running_loop()
+                for channel in new_channels:
+                    self._confirmations[channel] = loop.create_future()
+            for channel in channels:
+                self._subscribers.setdefault(channel, set()).add(queue)
+            if self._reader is None or self._reader.done():
+                self._reader = asyncio.create_task(self._read())
+            pending = [self._confirmations[channel] for channel in channels if channel in self._confirmations]
+        
+        # subscribe() only sends the command; the reader sees Redis's confirmation,
+        # after which every publish to the channel reaches us
+        try:
+            if pending:
+                done, waiting = await asyncio.wait(pending, timeout=settings.pubsub_subscribe_timeout)
+                if waiting:
+                    raise asyncio.TimeoutError("Redis did not confirm the subscription")
+                for future in done:
+                    future.result()
+        except BaseException:
+            await self._remove(queue, channels)
+            raise
+
+    async def _remove(self, queue: asyncio.Queue, channels: Tuple[str, ...]) -> None:
+        async with self._lock:
+            idle_channels = []
+            for channel in channels:
+                subscribers = self._subscribers.get(channel)
+                if subscribers is None:
+                    continue
+                subscribers.discard(queue)
+                if not subscribers:
+                    del self._subscribers[channel]
+                    idle_channels.append(channel)
+                    confirmation = self._confirmations.pop(channel, None)
+                    if confirmation is not None:
+                        confirmation.cancel()
+                        self._stale_confirmations[channel] = self._stale_confirmations.get(channel, 0) + 1
+            if idle_channels and self._pubsub is not None:
+                await self._pubsub.unsubscribe(*idle_channels)
+
+    async def _read(self) -> None:
+        """Dispatch incoming messages to local subscribers until cancelled."""
+        while True:
+            try:
+                if self._reconnect_needed:
+                    await self._reconnect()
+                if self._pubsub.connection is None:
+                    # Nothing subscribed since the last reconnect
+                    await asyncio.sleep(1)
+                    continue
+                message = await self._pubsub.get_message(timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Pub/sub read failed: %s", e)
+                self._reconnect_needed = True
+                await asyncio.sleep(1)
+                continue
+            if message is None:
+                continue
+            if message["type"] == "subscribe":
+                channel = message["channel"]
+                stale = self._stale_confirmations.pop(channel, 0)
+                if stale:
+                    # Answers an earlier SUBSCRIBE, not the one being awaited
+                    if stale > 1:
+                        self._stale_confirmations[channel] = stale - 1
+                    continue
+                confirmation = self._confirmations.pop(channel, None)
+                if confirmation is not None and not confirmation.done():
+                    confirmation.set_result(None)
+            elif message["type"] == "message":
+                self._dispatch(message["channel"], message["data"])
+
+    async def _reconnect(self) -> None:
+        """Replace the pub/sub connection and subscribe it to every channel in use.
+        
+        Confirmations still awaited are answered by the new subscription. Raises
+        if Redis is still unreachable; the reader then tries again.
+        """
+        async with self._lock:
+            stale, self._pubsub = self._pubsub, redis_client.redis.pubsub()
+            self._stale_confirmations.clear()
+            try:
+                await stale.close()
+            except Exception:
+                pass
+            if self._subscribers:
+                await self._pubsub.subscribe(*self._subscribers)
+            self._reconnect_needed = False
+            logger.info("Pub/sub reconnected with %d channels", len(self._subscribers))
+
+    def _dispatch(self, channel: str, data: str) -> None:
+        """Copy one message into every local subscriber's queue."""
+        for queue in list(self._subscribers.get(channel, ())):
+            queue.put_nowait((channel, data))
+
+    def buffered_bytes(self) -> List[int]:
+        """Unread bytes held for each local `LatestQueue` subscriber."""
+        queues = {queue for subscribers in self._subscribers.values() for queue in subscribers}
+        return [queue.buffered_bytes for queue in queues if isinstance(queue, LatestQueue)]
+
+    async def close(self) -> None:
+        """Stop reading and drop the pub/sub connection."""
+        if self._reader is not None:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except asyncio.CancelledError:
+                pass
+            self._reader = None
+        if self._pubsub is not None:
+            await self._pubsub.close()
+            self._pubsub = None
+        self._subscribers.clear()
+        self._stale_confirmations.clear()
+        for confirmation in self._confirmations.values():
+            confirmation.cancel()
+        self._confirmations.clear()
+
+
+# Global pub/sub hub instance
+pubsub_hub = PubSubHub()
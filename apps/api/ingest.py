@@ -0,0 +1,146 @@
+"""Group-commit vote ingestion.
+
+When a battle opens, thousands of phones vote within seconds. Instead of one
+transaction (and one fsync) per request, votes are buffered in-process and written
+by a single multi-row upsert every few milliseconds, so throughput grows with the
+batch size rather than being capped by commit latency.
+"""
+
+import asyncio
+import logging
+from typing import List, Optional, Tuple
+
+from config import settings
+from database import AsyncSessionLocal
+from metrics import RequestStats, current_request_stats, shared_request_stats, vote_batch_size
+from schemas import TallyResponse
+from tallies import record_tallies
+from votes import VoteRow, VoteWrite, read_tallies, upsert_votes
+
+logger = logging.getLogger(__name__)
+
+# What a submitted vote resolves to: its write and its battle's tally once the
+# batch committed (None if the live tally could not be updated)
+VoteOutcome = Tuple[VoteWrite, Optional[TallyResponse]]
+# A queued vote, its caller's future and the stats of the request that sent it
+_Pending = Tuple[VoteRow, "asyncio.Future[VoteOutcome]", Optional[RequestStats]]
+
+
+class VoteIngestor:
+    """Buffers votes and writes them in batches; each caller waits for its batch."""
+
+    def __init__(self, max_batch_size: int, max_delay: float):
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    async def start(self) -> None:
+        """Start the background writer."""
+        if self._task is None:
+            self._closing = False
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Write every vote already submitted, then stop the writer."""
+        if self._task is None:
+            return
+        self._closing = True
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        self._queue = None
+
+    async def submit(self, row: VoteRow) -> VoteOutcome:
+        """Queue a vote and wait until the batch holding it is committed."""
+        if self._closing:
+            raise RuntimeError("Vote ingestion is shutting down")
+        if self._task is None:
+            await self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((row, future, current_request_stats()))
+        return await future
+
+    async def _run(self) -> None:
+        """Collect batches until stopped; the stop marker is queued after real votes."""
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch: List[_Pending] = [item]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch_size:
+                if self._queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                await self._flush(batch)
+            except Exception as e:
+                # Fail this batch's callers but keep the writer alive for the next one
+                logger.exception("Vote batch of %d failed", len(batch))
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    async def _flush(self, batch: List[_Pending]) -> None:
+        """Write one batch, update its live tallies and resolve its callers.
+
+        The writer task runs outside any request, so the batch's DB and Redis
+        work is charged to the requests that submitted it, an equal share each.
+        """
+        rows = [row for row, _, _ in batch]
+        error = None
+        with shared_request_stats([stats for _, _, stats in batch]):
+            try:
+                async with AsyncSessionLocal() as db:
+                    writes = await upsert_votes(db, rows)
+                    # The versioned totals this batch commits, for the Redis mirror
+                    tally_rows = await read_tallies(db, [row.battle_id for row in rows])
+                    await db.commit()
+            except Exception as e:
+                error = e
+            else:
+                vote_batch_size.observe(value=len(batch))
+                try:
+                    tallies = await record_tallies(tally_rows)
+                except Exception as e:
+                    # The votes are durable; reconciliation repairs the counters
+                    logger.warning("Live tally update failed: %s", e)
+                    tallies = {}
+
+        if error is not None:
+            if len(batch) > 1:
+                # Don't let one bad vote fail everyone who shared its commit
+                for pending in batch:
+                    await self._flush([pending])
+                return
+            _, future, _ = batch[0]
+            if not future.done():
+                future.set_exception(error)
+            return
+
+        for (row, future, _), write in zip(batch, writes):
+            if not future.done():
+                future.set_result((write, tallies.get(row.battle_id)))
+
+
+# Global vote ingestor instance
+vote_ingestor = VoteIngestor(
+    max_batch_size=settings.vote_batch_max_size,
+    max_delay=settings.vote_batch_max_delay_ms / 1000,
+)
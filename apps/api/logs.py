@@ -0,0 +1,20 @@
+"""Logging setup for the API."""
+
+import logging
+import random
+
+from config import settings
+
+
+def configure_logging() -> None:
+    """Configure the root logger from `settings.log_level`."""
+    logging.basicConfig(
+        level=settings.log_level.upper(),
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
+
+
+def debug_sampled(logger: logging.Logger, msg: str, *args) -> None:
+    """Log at DEBUG for a sample of calls, so hot paths can stay instrumented."""
+    if logger.isEnabledFor(logging.DEBUG) and random.random() < settings.debug_log_sample_rate:
+        logger.debug(msg, *args)
@@ -1,47 +1,62 @@
 """Main FastAPI application."""
 
+import asyncio
+import json
+import logging
 import sys
+import time
 import os
-from contextlib import asynccontextmanager
-from typing import AsyncGenerator
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import AsyncGenerator, Optional
 
-from fastapi import FastAPI, HTTPException, status, Depends, Request
+from fastapi import FastAPI, HTTPException, status, Depends, Header, Request, Query, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, HTMLResponse
-import qrcode
-from io import BytesIO
-import base64
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-
-from database import get_db, engine
-from models import Base, Battle, Vote, Event, BattleStatus, VoteChoice
+from fastapi.responses import HTMLResponse, PlainTextResponse
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal, get_async_db, async_engine
+from models import Battle, BattleTally, Invalidation, Vote, Event, BattleStatus, VoteChoice
 from schemas import (
     HealthResponse, VoteRequest, VoteResponse, TallyResponse, 
-    BattleResponse, AdminOpenBattleRequest, AdminCreateBattleRequest
+    BattleResponse, AdminOpenBattleRequest, AdminCreateBattleRequest, AdminRateLimitRequest
 )
-from auth import get_current_event, verify_admin_key, get_client_ip, create_event_token
-from redis_client import redis_client
+from auth import get_current_event, verify_admin_key, get_client_ip, create_event_token, verify_event_token
+from redis_client import parse_update, redis_client, update_position
 from config import settings
+from tallies import get_live_tally, run_tally_reconciler, tally_etag, wait_for_tally
+from battle_cache import battle_cache
+from hub import LatestQueue, pubsub_hub
+from ingest import vote_ingestor
+from publisher import tally_publisher
+from votes import VoteRow, canonical_id
+from qr import battle_url as get_battle_url, qr_renderer
+from http_cache import cache_headers, etag_matches, not_modified
+from sse import HEARTBEAT, EventStreamResponse, next_message
+from logs import configure_logging, debug_sampled
+import metrics
 
-# Create tables
-Base.metadata.create_all(bind=engine)
-
-# Run migrations on startup
-try:
-    from migrations import run_migrations
-    run_migrations()
-    print("✅ Migrations completed")
-except Exception as e:
-    print(f"⚠️ Migration check: {e}")
-
+configure_logging()
+logger = logging.getLogger(__name__)
+metrics.instrument_engine(async_engine.sync_engine)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
     """Application lifespan manager."""
     # Startup
+    await vote_ingestor.start()
+    cache_listener = asyncio.create_task(battle_cache.listen_for_invalidations())
+    reconciler = None
+    if settings.redis_tallies:
+        reconciler = asyncio.create_task(run_tally_reconciler())
     yield
     # Shutdown
+    await vote_ingestor.stop()
+    await tally_publisher.close()
+    if reconciler is not None:
+        reconciler.cancel()
+    cache_listener.cancel()
+    await pubsub_hub.close()
     await redis_client.close()
 
 
@@ -61,6 +76,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-route latency, in-flight and per-request DB/Redis metrics
+app.add_middleware(metrics.MetricsMiddleware, router_app=app)
+
 
 @app.get("/healthz", response_model=HealthResponse)
 async def health_check():
@@ -68,128 +86,132 @@ async def health_check():
     return HealthResponse(status="ok")
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus metrics for this worker."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/events/{event_id}")
-async def get_event(event_id: str, db: Session = Depends(get_db)):
+async def get_event(
+    event_id: str,
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_async_db)
+):
     """Get event details."""
-    event = db.query(Event).filter(Event.id == event_id).first()
+    event = await battle_cache.get_event(event_id, db)
     if not event:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Event not found"
         )
-    return {
-        "id": str(event.id),
-        "name": event.name,
-        "created_at": event.created_at.isoformat()
-    }
+    headers = cache_headers(event.etag, settings.metadata_http_max_age, settings.metadata_http_max_age)
+    if etag_matches(request, event.etag):
+        return not_modified(headers)
+    response.headers.update(headers)
+    return event.to_dict()
 
 
 @app.get("/battles/{battle_id}", response_model=BattleResponse)
-async def get_battle(battle_id: str, db: Session = Depends(get_db)):
+async def get_battle(
+    battle_id: str,
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_async_db)
+):
     """Get battle details."""
-    battle = db.query(Battle).filter(Battle.id == battle_id).first()
+    battle = await battle_cache.get(battle_id, db)
     if not battle:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Battle not found"
         )
+    headers = cache_headers(battle.etag, settings.metadata_http_max_age, settings.metadata_http_max_age)
+    if etag_matches(request, battle.etag):
+        return not_modified(headers)
+    response.headers.update(headers)
     return battle
 
 
-@app.post("/vote", response_model=VoteResponse)
-async def vote(
-    request: Request,
-    event_data: dict = Depends(get_current_event),
-    db: Session = Depends(get_db)
-):
-    """Cast a vote for a battle."""
-    import json
-    
-    # Debug the raw request
-    body = await request.body()
-    print(f"DEBUG VOTE: Raw request body: {body}")
-    print(f"DEBUG VOTE: Request headers: {dict(request.headers)}")
-    
-    try:
-        # Parse JSON manually
-        data = json.loads(body) if body else {}
-        print(f"DEBUG VOTE: Parsed JSON data: {data}")
-        
-        # Extract vote data
-        battle_id = data.get('battle_id')
-        choice = data.get('choice')
-        device_hash = data.get('device_hash')
-        
-        if not battle_id or not choice or not device_hash:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Missing required fields: battle_id, choice, device_hash"
-            )
-            
-    except json.JSONDecodeError as e:
-        print(f"DEBUG VOTE: JSON decode error: {e}")
+async def cast_vote(
+    battle_id: Optional[str],
+    choice: Optional[str],
+    device_hash: Optional[str],
+    event_id: str,
+    ip_address: str,
+    db: Optional[AsyncSession] = None
+) -> VoteResponse:
+    """Validate, rate limit and record one vote; raises HTTPException if rejected."""
+    if not battle_id or not choice or not device_hash:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Invalid JSON format"
+            detail="Missing required fields: battle_id, choice, device_hash"
+        )
+    if choice not in {c.value for c in VoteChoice}:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid choice"
         )
     
     # Get battle
-    battle = db.query(Battle).filter(Battle.id == battle_id).first()
+    battle = await battle_cache.get(battle_id, db)
     if not battle:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Battle not found"
         )
+    # Any UUID spelling finds the battle; write and publish under the canonical one
+    battle_id = str(battle.id)
     
     # Check if battle is open
     if battle.status != BattleStatus.OPEN:
+        metrics.votes_total.inc("closed")
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Battle is not open for voting"
         )
     
     # Check if battle belongs to the event
-    if str(battle.event_id) != event_data["event_id"]:
+    if str(battle.event_id) != event_id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Battle does not belong to this event"
         )
     
-    # Get client IP and check rate limit
-    ip_address = get_client_ip(request)
-    if not await redis_client.check_rate_limit(ip_address):
+    # Check rate limit
+    rate_limit = await redis_client.check_rate_limit(
+        ip_address, device_hash=device_hash, event_id=event_id
+    )
+    if not rate_limit.allowed:
+        metrics.votes_total.inc("rate_limited")
         raise HTTPException(
             status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-            detail="Rate limit exceeded. Please try again later."
+            detail="Rate limit exceeded. Please try again later.",
+            headers={"Retry-After": str(rate_limit.retry_after)}
         )
     
-    # Check for existing vote from this device (allow changing vote)
-    existing_vote = db.query(Vote).filter(
-        Vote.battle_id == battle_id,
-        Vote.device_hash == device_hash
-    ).first()
+    # Hand the connection back before waiting on the shared batch commit
+    if db is not None:
+        await db.close()
     
-    if existing_vote:
-        # Update existing vote instead of rejecting
-        existing_vote.choice = VoteChoice(choice)
-        db.commit()
-        db.refresh(existing_vote)
+    # Insert the vote, or change this device's existing vote; returns once committed
+    vote_write, tally = await vote_ingestor.submit(VoteRow(
+        battle_id=battle_id,
+        choice=choice,
+        device_hash=device_hash,
+        ip_address=ip_address
+    ))
+    if not vote_write.changed:
+        metrics.votes_total.inc("unchanged")
+    elif vote_write.previous_choice is not None:
+        metrics.votes_total.inc("changed")
     else:
-        # Create new vote
-        vote = Vote(
-            battle_id=battle_id,
-            choice=VoteChoice(choice),
-            device_hash=device_hash,
-            ip_address=ip_address
-        )
-        db.add(vote)
-        db.commit()
-        db.refresh(vote)
+        metrics.votes_total.inc("accepted")
     
-    # Get current tally and publish update
-    tally = await get_tallies_from_db(str(battle_id), db)
-    await redis_client.set_tally(str(battle_id), {"A": tally.A, "B": tally.B, "REPLICA": tally.REPLICA})
-    await redis_client.publish_tally(str(battle_id), {"A": tally.A, "B": tally.B, "REPLICA": tally.REPLICA})
+    # Schedule a (coalesced) live update
+    if tally is not None:
+        tally_publisher.schedule(battle_id, tally.model_dump())
     
     return VoteResponse(
         success=True,
@@ -198,19 +220,168 @@ async def vote(
     )
 
 
+@app.post("/vote", response_model=VoteResponse)
+async def vote(
+    request: Request,
+    event_data: dict = Depends(get_current_event),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Cast a vote for a battle."""
+    import json
+    
+    body = await request.body()
+    
+    try:
+        # Parse JSON manually
+        data = json.loads(body) if body else {}
+        debug_sampled(logger, "Vote request: %s", data)
+    except json.JSONDecodeError as e:
+        logger.debug("Vote JSON decode error: %s", e)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid JSON format"
+        )
+    
+    return await cast_vote(
+        data.get('battle_id'),
+        data.get('choice'),
+        data.get('device_hash'),
+        event_data["event_id"],
+        get_client_ip(request),
+        db
+    )
+
+
+@app.websocket("/ws/battles/{battle_id}")
+async def battle_websocket(websocket: WebSocket, battle_id: str):
+    """Vote and receive live tallies over one connection.
+    
+    The event token is checked once, from the Authorization header or the
+    `token` query parameter. Client frames are
+    `{"type": "vote", "choice": ..., "device_hash": ..., "id": ...}`; the server
+    answers each with a `vote` or `error` frame echoing `id`, and pushes
+    `{"type": "tally", "tally": {...}}` whenever the tally changes.
+    """
+    token = websocket.query_params.get("token")
+    authorization = websocket.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        token = authorization[7:]
+    try:
+        event_data = verify_event_token(token or "")
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid or expired token")
+        return
+    
+    battle = await battle_cache.get(battle_id)
+    if not battle or str(battle.event_id) != event_data["event_id"]:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Battle not found")
+        return
+    # Tallies are published under the canonical id, whatever spelling the path used
+    battle_id = str(battle.id)
+    
+    await websocket.accept()
+    ip_address = get_client_ip(websocket)
+    send_lock = asyncio.Lock()
+    
+    async def send(frame: dict) -> None:
+        async with send_lock:
+            await websocket.send_json(frame)
+    
+    async def push_tallies(updates: LatestQueue) -> None:
+        while True:
+            _, message = await updates.get()
+            await send({"type": "tally", "tally": json.loads(parse_update(message)[1])})
+    
+    metrics.websocket_connections.inc()
+    try:
+        # Subscribe before the snapshot so no update falls between the two
+        async with pubsub_hub.subscribe(f"battle:{battle_id}:tally", queue=LatestQueue()) as updates:
+            async with AsyncSessionLocal() as db:
+                tally = await get_live_tally(battle_id, db)
+            await send({"type": "tally", "tally": tally.model_dump()})
+            pusher = asyncio.create_task(push_tallies(updates))
+            try:
+                while True:
+                    # receive_json() would raise KeyError on a binary frame
+                    message = await websocket.receive()
+                    if message["type"] == "websocket.disconnect":
+                        raise WebSocketDisconnect(message.get("code", status.WS_1000_NORMAL_CLOSURE))
+                    if message.get("text") is None:
+                        await websocket.close(code=status.WS_1003_UNSUPPORTED_DATA, reason="Text frames only")
+                        return
+                    try:
+                        frame = json.loads(message["text"])
+                    except ValueError:
+                        await send({"type": "error", "status": 400, "detail": "Invalid JSON format"})
+                        continue
+                    if not isinstance(frame, dict) or frame.get("type") != "vote":
+                        await send({"type": "error", "status": 400, "detail": "Unknown frame type"})
+                        continue
+                    
+                    frame_id = frame.get("id")
+                    expires_at = event_data.get("exp")
+                    if expires_at is not None and expires_at < time.time():
+                        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Token expired")
+                        return
+                    try:
+                        result = await cast_vote(
+                            battle_id,
+                            frame.get("choice"),
+                            frame.get("device_hash"),
+                            event_data["event_id"],
+                            ip_address
+                        )
+                    except HTTPException as e:
+                        error = {"type": "error", "id": frame_id, "status": e.status_code, "detail": e.detail}
+                        if e.headers and "Retry-After" in e.headers:
+                            error["retry_after"] = int(e.headers["Retry-After"])
+                        await send(error)
+                        continue
+                    await send({"type": "vote", "id": frame_id, **result.model_dump()})
+            finally:
+                pusher.cancel()
+                await asyncio.gather(pusher, return_exceptions=True)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        metrics.websocket_connections.dec()
+
+
 @app.get("/tallies/{battle_id}", response_model=TallyResponse)
-async def get_tallies(battle_id: str, db: Session = Depends(get_db)):
-    """Get current tallies for a battle."""
-    return await get_tallies_from_db(battle_id, db)
+async def get_tallies(
+    battle_id: str,
+    request: Request,
+    response: Response,
+    since: Optional[int] = Query(None, description="Tally version already seen; waits for a newer one"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Get current tallies for a battle, or long-poll for the next change with `since`."""
+    # Redis keys and channels use the id as Postgres spells it
+    try:
+        battle_id = canonical_id(battle_id)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Battle not found")
+    # Live tallies come from Redis, so an unchanged poll never touches Postgres
+    if since is None:
+        tally = await get_live_tally(battle_id, db)
+    else:
+        tally = await wait_for_tally(battle_id, since, db, settings.tally_long_poll_timeout)
+    etag = tally_etag(tally)
+    headers = cache_headers(etag, settings.tally_http_max_age, settings.tally_http_max_age)
+    if etag_matches(request, etag):
+        return not_modified(headers)
+    response.headers.update(headers)
+    return tally
 
 
 @app.get("/votes/{battle_id}/check/{device_hash}")
-async def check_if_voted(battle_id: str, device_hash: str, db: Session = Depends(get_db)):
+async def check_if_voted(battle_id: str, device_hash: str, db: AsyncSession = Depends(get_async_db)):
     """Check if a device has already voted in a battle."""
-    vote = db.query(Vote).filter(
+    result = await db.execute(select(Vote).filter(
         Vote.battle_id == battle_id,
         Vote.device_hash == device_hash
-    ).first()
+    ))
+    vote = result.scalars().first()
     
     return {
         "has_voted": vote is not None,
@@ -218,74 +389,163 @@ async def check_if_voted(battle_id: str, device_hash: str, db: Session = Depends
     }
 
 
-async def get_tallies_from_db(battle_id: str, db: Session) -> TallyResponse:
-    """Get tallies from database."""
-    # Don't use Redis cache for real-time results
-    # Always query from database for accuracy
+@app.get("/sse/battles/{battle_id}")
+async def battle_sse(battle_id: str, last_event_id: Optional[str] = Header(None)):
+    """Server-Sent Events endpoint for live battle updates.
+    
+    Sends tallies as unnamed events and battle status changes as `status`
+    events, each with its update stream id. A reconnecting EventSource sends
+    Last-Event-ID and gets what it missed from the stream, with no database
+    work, as long as the capped stream still reaches back that far. Otherwise
+    the stream starts from a tally snapshot, preceded by the battle's status
+    when a resume had to be abandoned.
+    
+    Streams never hold a pooled connection: the snapshot uses a short-lived
+    session that is returned before the first event is sent. A slow reader
+    only ever has the newest tally waiting for it.
+    """
+    # Verify battle exists
+    battle = await battle_cache.get(battle_id)
+    if not battle:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Battle not found"
+        )
+    # Channels, the update stream and status ids all use the canonical id
+    battle_id = str(battle.id)
     
-    # Query database
-    result = db.query(
-        Vote.choice,
-        func.count(Vote.id).label('count')
-    ).filter(
-        Vote.battle_id == battle_id
-    ).group_by(Vote.choice).all()
+    tally_channel = f"battle:{battle_id}:tally"
+    status_channel = f"event:{battle.event_id}:battles"
     
-    tally = {"A": 0, "B": 0, "REPLICA": 0}
-    for choice, count in result:
-        # choice is a VoteChoice enum, get its value
-        choice_value = choice.value if hasattr(choice, 'value') else str(choice)
-        tally[choice_value] = count
+    def update_key(channel: str, message: str):
+        # The event channel carries every battle's status; keep the latest of each
+        if channel == status_channel:
+            return channel, json.loads(parse_update(message)[1])["id"]
+        return channel
     
-    # Cache the result
-    await redis_client.set_tally(battle_id, tally)
+    async def event_generator():
+        """Generate SSE events."""
+        # Subscribe before the snapshot so no update falls between the two
+        async with pubsub_hub.subscribe(
+            tally_channel, status_channel, queue=LatestQueue(key=update_key)
+        ) as updates:
+            missed = None
+            if last_event_id:
+                missed = await redis_client.read_battle_updates(battle_id, after=last_event_id)
+            if missed is None:
+                # Read the position first: the snapshot is at least that new
+                last_id = await redis_client.last_battle_update_id(battle_id)
+                current = None
+                async with AsyncSessionLocal() as db:
+                    if last_event_id:
+                        # Resuming failed, so the client may have missed status changes too
+                        current = await db.get(Battle, battle.id)
+                    initial_tally = await get_live_tally(battle_id, db)
+                if current is not None:
+                    yield f"event: status\ndata: {BattleResponse.model_validate(current).model_dump_json()}\n\n"
+                yield f"id: {last_id}\ndata: {initial_tally.json()}\n\n"
+            else:
+                last_id = last_event_id
+                # Every update is a full snapshot, so the newest of each type will do
+                latest = {update.type: update for update in missed}
+                for update in sorted(latest.values(), key=lambda update: update_position(update.id)):
+                    event = "event: status\n" if update.type == "status" else ""
+                    yield f"id: {update.id}\n{event}data: {update.data}\n\n"
+                    last_id = update.id
+            
+            # Listen for updates
+            while True:
+                message = await next_message(updates)
+                if message is None:
+                    yield HEARTBEAT
+                    continue
+                channel, payload = message
+                entry_id, data = parse_update(payload)
+                if channel == status_channel and json.loads(data)["id"] != battle_id:
+                    continue
+                if update_position(entry_id) <= update_position(last_id):
+                    # Already covered by the snapshot or the replay
+                    continue
+                event = "event: status\n" if channel == status_channel else ""
+                yield f"id: {entry_id}\n{event}data: {data}\n\n"
+                last_id = entry_id
     
-    return TallyResponse(A=tally["A"], B=tally["B"], REPLICA=tally["REPLICA"])
+    return EventStreamResponse(event_generator())
 
 
-@app.get("/sse/battles/{battle_id}")
-async def battle_sse(battle_id: str, db: Session = Depends(get_db)):
-    """Server-Sent Events endpoint for live battle updates."""
-    import redis.asyncio as redis
-    import json
+@app.get("/sse/events/{event_id}")
+async def event_sse(event_id: str):
+    """Server-Sent Events for every battle of an event on one stream.
     
-    # Verify battle exists
-    battle = db.query(Battle).filter(Battle.id == battle_id).first()
-    if not battle:
+    Sends a `status` event (the battle) and a `tally` event (counts plus
+    `battle_id`) per battle, then one of each whenever a battle is created,
+    opened or closed, or its tally changes.
+    """
+    event = await battle_cache.get_event(event_id)
+    if not event:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail="Battle not found"
+            detail="Event not found"
         )
     
+    status_channel = f"event:{event_id}:battles"
+    
+    def update_key(channel: str, message: str):
+        # Keep the latest status of every battle, not just the latest status message
+        if channel == status_channel:
+            return channel, json.loads(parse_update(message)[1])["id"]
+        return channel
+    
+    def tally_event(battle_id: str, tally: dict) -> str:
+        return f"event: tally\ndata: {json.dumps({'battle_id': battle_id, **tally})}\n\n"
+    
     async def event_generator():
         """Generate SSE events."""
-        r = redis.from_url(settings.redis_url, decode_responses=True)
-        pubsub = r.pubsub()
-        
-        try:
-            await pubsub.subscribe(f"battle:{battle_id}:tally")
+        async with AsyncExitStack() as subscriptions:
+            # Subscribe before the snapshot so no update falls between the two
+            updates = await subscriptions.enter_async_context(
+                pubsub_hub.subscribe(status_channel, queue=LatestQueue(key=update_key))
+            )
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(select(Battle).filter(Battle.event_id == event_id))
+                battles = result.scalars().all()
+                battle_ids = {str(battle.id) for battle in battles}
+                await subscriptions.enter_async_context(pubsub_hub.subscribe(
+                    *(f"battle:{battle_id}:tally" for battle_id in battle_ids), queue=updates
+                ))
+                snapshot = [(battle, await get_live_tally(str(battle.id), db)) for battle in battles]
             
-            # Send initial tally
-            initial_tally = await get_tallies_from_db(battle_id, db)
-            yield f"data: {initial_tally.json()}\n\n"
+            for battle, tally in snapshot:
+                yield f"event: status\ndata: {BattleResponse.model_validate(battle).model_dump_json()}\n\n"
+                yield tally_event(str(battle.id), tally.model_dump())
             
             # Listen for updates
-            async for message in pubsub.listen():
-                if message['type'] == 'message':
-                    yield f"data: {message['data']}\n\n"
-                    
-        finally:
-            await pubsub.unsubscribe(f"battle:{battle_id}:tally")
-            await r.close()
-    
-    return StreamingResponse(
-        event_generator(),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "Access-Control-Allow-Origin": "*",
-        }
+            while True:
+                message = await next_message(updates)
+                if message is None:
+                    yield HEARTBEAT
+                    continue
+                channel, payload = message
+                _, data = parse_update(payload)
+                if channel != status_channel:
+                    yield tally_event(channel.split(":")[1], json.loads(data))
+                    continue
+                battle_id = json.loads(data)["id"]
+                if battle_id not in battle_ids:
+                    # A battle created after we connected
+                    battle_ids.add(battle_id)
+                    await subscriptions.enter_async_context(
+                        pubsub_hub.subscribe(f"battle:{battle_id}:tally", queue=updates)
+                    )
+                yield f"event: status\ndata: {data}\n\n"
+    
+    return EventStreamResponse(event_generator())
+
+
+async def announce_battle(battle: Battle) -> None:
+    """Tell the event-wide streams about a battle's new state."""
+    await redis_client.publish_battle_status(
+        str(battle.id), str(battle.event_id), BattleResponse.model_validate(battle).model_dump_json()
     )
 
 
@@ -295,22 +555,20 @@ async def open_battle(
     battle_id: str,
     request: Request,
     _: None = Depends(verify_admin_key),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Open a battle for voting (admin only)."""
     import json
     
-    # Debug the raw request
     body = await request.body()
-    print(f"DEBUG OPEN: Raw request body: {body}")
-    print(f"DEBUG OPEN: Request headers: {dict(request.headers)}")
     
     try:
         # Parse JSON manually
         data = json.loads(body) if body else {}
-        print(f"DEBUG OPEN: Parsed JSON data: {data}")
+        logger.debug("Open battle %s: %s", battle_id, data)
         
-        battle = db.query(Battle).filter(Battle.id == battle_id).first()
+        result = await db.execute(select(Battle).filter(Battle.id == battle_id))
+        battle = result.scalars().first()
         if not battle:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -325,11 +583,13 @@ async def open_battle(
         if data.get("ends_at"):
             battle.ends_at = data["ends_at"]
         
-        db.commit()
+        await db.commit()
+        await battle_cache.broadcast_invalidation(battle_id=str(battle.id))
+        await announce_battle(battle)
         
         return {"message": "Battle opened successfully"}
     except Exception as e:
-        print(f"DEBUG OPEN: Error: {e}")
+        logger.warning("Failed to open battle %s: %s", battle_id, e)
         raise HTTPException(status_code=400, detail=str(e))
 
 
@@ -337,10 +597,11 @@ async def open_battle(
 async def close_battle(
     battle_id: str,
     _: None = Depends(verify_admin_key),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Close a battle for voting (admin only)."""
-    battle = db.query(Battle).filter(Battle.id == battle_id).first()
+    result = await db.execute(select(Battle).filter(Battle.id == battle_id))
+    battle = result.scalars().first()
     if not battle:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -348,7 +609,12 @@ async def close_battle(
         )
     
     battle.status = BattleStatus.CLOSED
-    db.commit()
+    await db.commit()
+    await battle_cache.broadcast_invalidation(battle_id=str(battle.id))
+    
+    # Make sure viewers get the final tally
+    await tally_publisher.flush(str(battle.id))
+    await announce_battle(battle)
     
     return {"message": "Battle closed successfully"}
 
@@ -363,25 +629,44 @@ async def create_event_token_endpoint(
     return {"event_id": event_id, "token": token}
 
 
+@app.get("/admin/events/{event_id}/rate-limits")
+async def get_event_rate_limits(
+    event_id: str,
+    _: None = Depends(verify_admin_key)
+):
+    """Get an event's rate limit overrides (admin only)."""
+    overrides = await redis_client.get_rate_limit_overrides(event_id)
+    return {"event_id": event_id, "rate_limits": overrides}
+
+
+@app.put("/admin/events/{event_id}/rate-limits")
+async def set_event_rate_limits(
+    event_id: str,
+    limits: AdminRateLimitRequest,
+    _: None = Depends(verify_admin_key)
+):
+    """Override the vote rate limits for one event (admin only)."""
+    overrides = limits.model_dump(exclude_none=True)
+    await redis_client.set_rate_limit_overrides(event_id, overrides)
+    return {"event_id": event_id, "rate_limits": overrides}
+
+
 @app.post("/admin/battles")
 async def create_battle(
     request: Request,
     _: None = Depends(verify_admin_key),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Create a new battle (admin only)."""
     import uuid
     import json
     
-    # Debug the raw request first
     body = await request.body()
-    print(f"DEBUG: Raw request body: {body}")
-    print(f"DEBUG: Request headers: {dict(request.headers)}")
     
     try:
         # Parse JSON manually
         data = json.loads(body)
-        print(f"DEBUG: Parsed JSON data: {data}")
+        logger.debug("Create battle: %s", data)
         
         # Create battle manually
         battle = Battle(
@@ -395,8 +680,10 @@ async def create_battle(
         )
         
         db.add(battle)
-        db.commit()
-        db.refresh(battle)
+        await db.commit()
+        await db.refresh(battle)
+        await battle_cache.broadcast_invalidation(battle_id=battle.id)
+        await announce_battle(battle)
         
         return {
             "id": battle.id,
@@ -407,18 +694,19 @@ async def create_battle(
             "ends_at": battle.ends_at
         }
     except Exception as e:
-        print(f"DEBUG: Error: {e}")
+        logger.warning("Failed to create battle: %s", e)
         raise HTTPException(status_code=400, detail=str(e))
 
 
 @app.get("/admin/events")
 async def get_all_events(
     _: None = Depends(verify_admin_key),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get all events (admin only)."""
     # Get all events from the events table
-    events = db.query(Event).all()
+    result = await db.execute(select(Event))
+    events = result.scalars().all()
     
     # Don't auto-create default event - let the list be empty if no events exist
     
@@ -436,26 +724,25 @@ async def get_all_events(
 async def create_event(
     request: Request,
     _: None = Depends(verify_admin_key),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Create a new event (admin only)."""
     try:
         # Manually parse the request body
         body = await request.body()
-        print(f"DEBUG CREATE EVENT: Raw request body: {body}")
-        print(f"DEBUG CREATE EVENT: Request headers: {dict(request.headers)}")
         
         import json
         event_data = json.loads(body)
-        print(f"DEBUG CREATE EVENT: Parsed JSON data: {event_data}")
+        logger.debug("Create event: %s", event_data)
         
         # Create new event
         new_event = Event(
             name=event_data["name"]
         )
         db.add(new_event)
-        db.commit()
-        db.refresh(new_event)
+        await db.commit()
+        await db.refresh(new_event)
+        await battle_cache.broadcast_invalidation(event_id=new_event.id)
         
         return {
             "id": str(new_event.id),
@@ -463,8 +750,8 @@ async def create_event(
             "created_at": new_event.created_at.isoformat()
         }
     except Exception as e:
-        db.rollback()
-        print(f"DEBUG: Error creating event: {e}")
+        await db.rollback()
+        logger.warning("Failed to create event: %s", e)
         raise HTTPException(status_code=400, detail=str(e))
 
 
@@ -472,42 +759,53 @@ async def create_event(
 async def delete_event(
     event_id: str,
     _: None = Depends(verify_admin_key),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Delete an event (admin only)."""
+    """Delete an event with its battles, votes and tallies (admin only)."""
     try:
         # Check if event exists
-        event = db.query(Event).filter(Event.id == event_id).first()
+        result = await db.execute(select(Event).filter(Event.id == event_id))
+        event = result.scalars().first()
         if not event:
             raise HTTPException(status_code=404, detail="Event not found")
         
         # Delete all battles associated with this event first
-        battles_count = db.query(Battle).filter(Battle.event_id == event_id).count()
+        result = await db.execute(
+            select(func.count()).select_from(Battle).filter(Battle.event_id == event_id)
+        )
+        battles_count = result.scalar_one()
         if battles_count > 0:
-            # Delete all battles for this event
-            db.query(Battle).filter(Battle.event_id == event_id).delete()
-            print(f"DEBUG: Deleted {battles_count} battles for event {event_id}")
+            # Nothing cascades in the schema, so clear the battles' votes and tallies too
+            battle_ids = select(Battle.id).filter(Battle.event_id == event_id).scalar_subquery()
+            vote_ids = select(Vote.id).filter(Vote.battle_id.in_(battle_ids)).scalar_subquery()
+            await db.execute(delete(Invalidation).filter(Invalidation.vote_id.in_(vote_ids)))
+            await db.execute(delete(Vote).filter(Vote.battle_id.in_(battle_ids)))
+            await db.execute(delete(BattleTally).filter(BattleTally.battle_id.in_(battle_ids)))
+            await db.execute(delete(Battle).filter(Battle.event_id == event_id))
+            logger.info("Deleted %d battles with their votes for event %s", battles_count, event_id)
         
         # Delete the event
-        db.delete(event)
-        db.commit()
+        await db.delete(event)
+        await db.commit()
+        await battle_cache.broadcast_invalidation(event_id=event_id)
         
         return {"message": "Event deleted successfully"}
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
-        print(f"DEBUG: Error deleting event: {e}")
+        await db.rollback()
+        logger.warning("Failed to delete event %s: %s", event_id, e)
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/admin/events/{event_id}/battles")
 async def get_battles_by_event(
     event_id: str,
     _: None = Depends(verify_admin_key),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get all battles for an event (admin only)."""
-    battles = db.query(Battle).filter(Battle.event_id == event_id).all()
+    result = await db.execute(select(Battle).filter(Battle.event_id == event_id))
+    battles = result.scalars().all()
     
     return [
         {
@@ -526,75 +824,65 @@ async def get_battles_by_event(
 @app.get("/battles/{battle_id}/qr")
 async def get_battle_qr_code(
     battle_id: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Generate QR code for a battle."""
-    battle = db.query(Battle).filter(Battle.id == battle_id).first()
+    battle = await battle_cache.get(battle_id, db)
     if not battle:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Battle not found"
         )
     
-    # Create QR code
-    battle_url = f"http://localhost:3000/battle/{battle_id}"
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(battle_url)
-    qr.make(fit=True)
-    
-    # Create QR code image
-    img = qr.make_image(fill_color="black", back_color="white")
-    
-    # Convert to base64
-    buffer = BytesIO()
-    img.save(buffer, format='PNG')
-    img_str = base64.b64encode(buffer.getvalue()).decode()
+    battle_url = get_battle_url(battle_id)
+    image = await qr_renderer.render(battle_url)
     
     return {
         "battle_id": battle_id,
         "battle_name": f"{battle.mc_a} vs {battle.mc_b}",
-        "qr_code": f"data:image/png;base64,{img_str}",
+        "qr_code": image.data_url,
         "url": battle_url,
         "status": battle.status
     }
 
 
+@app.get("/battles/{battle_id}/qr.png")
+async def get_battle_qr_png(
+    battle_id: str,
+    request: Request,
+    size: int = Query(10, ge=1, le=40),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """QR code image for a battle, cacheable by browsers and proxies."""
+    battle = await battle_cache.get(battle_id, db)
+    if not battle:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Battle not found"
+        )
+    
+    image = await qr_renderer.render(get_battle_url(battle_id), size)
+    headers = cache_headers(image.etag, settings.qr_cache_max_age)
+    if etag_matches(request, image.etag):
+        return not_modified(headers)
+    return Response(content=image.png, media_type="image/png", headers=headers)
+
+
 @app.get("/battles/{battle_id}/qr-page", response_class=HTMLResponse)
 async def get_battle_qr_page(
     battle_id: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Generate QR code page for a battle."""
-    battle = db.query(Battle).filter(Battle.id == battle_id).first()
+    battle = await battle_cache.get(battle_id, db)
     if not battle:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Battle not found"
         )
     
-    # Create QR code
-    battle_url = f"http://localhost:3000/battle/{battle_id}"
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(battle_url)
-    qr.make(fit=True)
-    
-    # Create QR code image
-    img = qr.make_image(fill_color="black", back_color="white")
-    
-    # Convert to base64
-    buffer = BytesIO()
-    img.save(buffer, format='PNG')
-    img_str = base64.b64encode(buffer.getvalue()).decode()
+    battle_url = get_battle_url(battle_id)
+    battle_status = battle.status.value
     
     # Generate HTML page
     html_content = f"""
@@ -697,9 +985,9 @@ async def get_battle_qr_page(
             
             <div class="battle-info">
                 <div class="mc-names">{battle.mc_a} vs {battle.mc_b}</div>
-                <div class="status {battle.status}">
-                    {f'<span class="live-indicator"></span>' if battle.status == 'open' else ''}
-                    {battle.status.title()}
+                <div class="status {battle_status}">
+                    {'<span class="live-indicator"></span>' if battle_status == 'open' else ''}
+                    {battle_status.title()}
                 </div>
                 <div><strong>Starts:</strong> {battle.starts_at.strftime('%H:%M')}</div>
                 <div><strong>Ends:</strong> {battle.ends_at.strftime('%H:%M')}</div>
@@ -707,7 +995,7 @@ async def get_battle_qr_page(
             
             <div class="qr-code">
                 <h3>📱 Scan to Vote</h3>
-                <img src="data:image/png;base64,{img_str}" alt="QR Code" />
+                <img src="qr.png" alt="QR Code" />
             </div>
             
             <div class="url">
@@ -726,7 +1014,7 @@ async def get_battle_qr_page(
         
         <script>
             // Auto-refresh page every 30 seconds to check status
-            if ('{battle.status}' === 'scheduled') {{
+            if ('{battle_status}' === 'scheduled') {{
                 setTimeout(() => location.reload(), 30000);
             }}
         </script>
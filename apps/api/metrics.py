@@ -0,0 +1,401 @@
+"""Request metrics in Prometheus text format.
+
+A small in-process registry (counters, gauges, histograms) plus:
+
+- an ASGI middleware recording per-route latency, status and in-flight requests,
+- per-request DB and Redis call counts and durations, gathered through a
+  context variable fed by SQLAlchemy cursor events and `RedisClient` calls.
+  Work a background task does for several requests at once (the vote group
+  commit) is collected with `shared_request_stats` and charged to each of those
+  requests in equal shares, so the per-request figures still add up,
+- vote outcome and event token cache counters,
+- process memory and open file descriptors (read from /proc where available),
+
+all rendered by `render()` for the `/metrics` endpoint. Each worker process
+reports its own numbers; Prometheus aggregates across workers.
+"""
+
+import bisect
+import contextlib
+import contextvars
+import functools
+import os
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from starlette.routing import Match
+
+LabelValues = Tuple[str, ...]
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CALL_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """Monotonic counter with labels."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0)
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labels, values)} {_format_value(value)}"
+            for values, value in sorted(self._values.items())
+        ]
+
+
+class Gauge(Counter):
+    """Value that can go up and down, or be read from a callback."""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        callback: Optional[Callable[[], float]] = None,
+    ):
+        super().__init__(name, documentation, labels)
+        self.callback = callback
+
+    def dec(self, *label_values: str, amount: float = 1) -> None:
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, *label_values: str, value: float) -> None:
+        self._values[label_values] = value
+
+    def samples(self) -> List[str]:
+        if self.callback is not None:
+            self._values[()] = self.callback()
+        return super().samples()
+
+
+class Histogram:
+    """Bucketed distribution with labels; also estimates quantiles from buckets."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # Per label set: [bucket counts..., sum, count]
+        self._series: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, *label_values: str, value: float) -> None:
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def quantile(self, q: float, *label_values: str) -> Optional[float]:
+        """Estimate a quantile by linear interpolation inside its bucket."""
+        series = self._series.get(label_values)
+        if not series or not series[-1]:
+            return None
+        rank = q * series[-1]
+        seen = 0
+        for index, upper in enumerate(self.buckets):
+            count = series[index]
+            if seen + count >= rank and count:
+                lower = self.buckets[index - 1] if index else 0.0
+                if upper == float("inf"):
+                    return lower
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-2]
+
+    def samples(self) -> List[str]:
+        lines = []
+        for values, series in sorted(self._series.items()):
+            cumulative = 0
+            for upper, count in zip(self.buckets, series):
+                cumulative += count
+                le = f'le="{_format_value(upper)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, values, le)} {_format_value(cumulative)}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, values)} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, values)} {_format_value(series[-1])}")
+        return lines
+
+    def quantile_samples(self) -> List[str]:
+        lines = []
+        for values in sorted(self._series):
+            for q in QUANTILES:
+                estimate = self.quantile(q, *values)
+                quantile = f'quantile="{q}"'
+                lines.append(
+                    f"{self.name}_quantile{_format_labels(self.labels, values, quantile)} {_format_value(estimate)}"
+                )
+        return lines
+
+
+class Registry:
+    """Holds metrics and renders them in Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics: List = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+            if isinstance(metric, Histogram):
+                lines.append(f"# HELP {metric.name}_quantile {metric.documentation} (estimated quantiles)")
+                lines.append(f"# TYPE {metric.name}_quantile gauge")
+                lines.extend(metric.quantile_samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests_total = registry.register(Counter(
+    "http_requests_total", "HTTP requests handled.", ("method", "route", "status")))
+http_request_duration_seconds = registry.register(Histogram(
+    "http_request_duration_seconds", "Time to response start per route.", ("method", "route")))
+http_requests_in_flight = registry.register(Gauge(
+    "http_requests_in_flight", "HTTP requests currently being handled.", ("method", "route")))
+http_request_db_queries = registry.register(Histogram(
+    "http_request_db_queries", "Database queries per request.", ("route",), CALL_COUNT_BUCKETS))
+http_request_db_seconds = registry.register(Histogram(
+    "http_request_db_seconds", "Time spent in database queries per request.", ("route",)))
+http_request_redis_calls = registry.register(Histogram(
+    "http_request_redis_calls", "Redis calls per request.", ("route",), CALL_COUNT_BUCKETS))
+http_request_redis_seconds = registry.register(Histogram(
+    "http_request_redis_seconds", "Time spent in Redis calls per request.", ("route",)))
+db_queries_total = registry.register(Counter(
+    "db_queries_total", "Database queries, including background work."))
+redis_calls_total = registry.register(Counter(
+    "redis_calls_total", "Redis calls, including background work.", ("operation",)))
+votes_total = registry.register(Counter(
+    "votes_total", "Vote attempts by outcome.", ("outcome",)))
+token_cache_lookups_total = registry.register(Counter(
+    "token_cache_lookups_total", "Verified event token cache lookups by result (hit/miss).", ("result",)))
+websocket_connections = registry.register(Gauge(
+    "websocket_connections", "Open vote/tally WebSocket connections."))
+vote_batch_size = registry.register(Histogram(
+    "vote_batch_size", "Votes written per group commit.", (), (1, 2, 5, 10, 25, 50, 100, 200, 500)))
+sse_streams = registry.register(Gauge(
+    "sse_streams", "Open Server-Sent Events streams."))
+sse_streams_rejected_total = registry.register(Counter(
+    "sse_streams_rejected_total", "SSE streams shed at the per-process cap with a retry delay."))
+stream_messages_superseded_total = registry.register(Counter(
+    "stream_messages_superseded_total", "Live updates replaced by a newer one before a slow reader got them."))
+
+
+def _stream_buffers() -> List[int]:
+    from hub import pubsub_hub  # hub imports redis_client, which imports this module
+    return pubsub_hub.buffered_bytes()
+
+
+stream_buffered_bytes = registry.register(Gauge(
+    "stream_buffered_bytes", "Unread live-update bytes held for all streams.",
+    callback=lambda: sum(_stream_buffers())))
+stream_buffered_bytes_max = registry.register(Gauge(
+    "stream_buffered_bytes_max", "Unread live-update bytes held for the most backed-up stream.",
+    callback=lambda: max(_stream_buffers(), default=0)))
+
+
+def _resident_memory_bytes() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return 0
+
+
+def _open_fds() -> float:
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return 0
+
+
+process_resident_memory_bytes = registry.register(Gauge(
+    "process_resident_memory_bytes", "Resident memory of this worker.", callback=_resident_memory_bytes))
+process_open_fds = registry.register(Gauge(
+    "process_open_fds", "Open file descriptors (sockets included) of this worker.", callback=_open_fds))
+
+
+class RequestStats:
+    """DB and Redis usage attributed to the current request."""
+
+    __slots__ = ("db_queries", "db_seconds", "redis_calls", "redis_seconds")
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.redis_calls = 0
+        self.redis_seconds = 0.0
+
+
+_request_stats: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar(
+    "request_stats", default=None
+)
+
+
+def current_request_stats() -> Optional[RequestStats]:
+    """Stats of the request being handled, to hand to work done on its behalf."""
+    return _request_stats.get()
+
+
+@contextlib.contextmanager
+def shared_request_stats(requests: Sequence[Optional[RequestStats]]) -> Iterator[None]:
+    """Charge the DB and Redis usage inside the block to several requests.
+
+    Each entry of `requests` gets an equal share; None entries (work submitted
+    outside an HTTP request) take their share without recording it.
+    """
+    stats = RequestStats()
+    token = _request_stats.set(stats)
+    try:
+        yield
+    finally:
+        _request_stats.reset(token)
+        if requests:
+            share = 1 / len(requests)
+            for request in requests:
+                if request is not None:
+                    request.db_queries += stats.db_queries * share
+                    request.db_seconds += stats.db_seconds * share
+                    request.redis_calls += stats.redis_calls * share
+                    request.redis_seconds += stats.redis_seconds * share
+
+
+def record_redis_call(operation: str, seconds: float) -> None:
+    """Count one Redis round trip."""
+    redis_calls_total.inc(operation)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.redis_calls += 1
+        stats.redis_seconds += seconds
+
+
+def timed_redis(method):
+    """Decorate an async `RedisClient` method to be counted as a Redis call."""
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        finally:
+            record_redis_call(method.__name__, time.perf_counter() - started)
+    return wrapper
+
+
+def instrument_engine(engine) -> None:
+    """Count and time every query run through a SQLAlchemy engine."""
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        db_queries_total.inc()
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.db_queries += 1
+            stats.db_seconds += time.perf_counter() - started
+
+
+def _route_template(app, scope) -> str:
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", scope["path"])
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route request metrics.
+
+    Latency is measured to the start of the response, so long-lived streams
+    (SSE) report how fast they started rather than how long they stayed open.
+    """
+
+    def __init__(self, app, router_app=None):
+        self.app = app
+        self.router_app = router_app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = _route_template(self.router_app, scope) if self.router_app else scope["path"]
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        started = time.perf_counter()
+        response_status = [500]
+
+        async def send_with_metrics(message):
+            if message["type"] == "http.response.start":
+                response_status[0] = message["status"]
+                http_request_duration_seconds.observe(method, route, value=time.perf_counter() - started)
+            await send(message)
+
+        http_requests_in_flight.inc(method, route)
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            http_requests_in_flight.dec(method, route)
+            http_requests_total.inc(method, route, str(response_status[0]))
+            http_request_db_queries.observe(route, value=stats.db_queries)
+            http_request_db_seconds.observe(route, value=stats.db_seconds)
+            http_request_redis_calls.observe(route, value=stats.redis_calls)
+            http_request_redis_seconds.observe(route, value=stats.redis_seconds)
+            _request_stats.reset(token)
+
+
+def render() -> str:
+    """Render all metrics in Prometheus text format."""
+    return registry.render()
@@ -69,6 +69,17 @@ class Vote(Base):
     )
 
 
+class BattleTally(Base):
+    """Materialized vote count per battle and choice, moved with every vote write."""
+    __tablename__ = "battle_tallies"
+
+    battle_id = Column(UUID(as_uuid=True), primary_key=True)
+    choice = Column(Enum(VoteChoice), primary_key=True)
+    count = Column(BigInteger, nullable=False, default=0)
+    # Bumped with every change to count; orders writes to the Redis mirror
+    version = Column(BigInteger, nullable=False, default=0)
+
+
 class Invalidation(Base):
     """Vote invalidation model (optional)."""
     __tablename__ = "invalidations"
@@ -0,0 +1,71 @@
+"""Coalesced tally publishing.
+
+A burst of 500 votes/sec used to mean 500 pub/sub messages/sec pushed to every
+SSE client, although nobody can follow updates faster than ~10 Hz. Votes now only
+mark their battle dirty; each battle's tally goes out at most once per interval,
+carrying whatever the tally is at send time.
+"""
+
+import asyncio
+import logging
+from typing import Dict
+
+from config import settings
+from redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+
+class TallyPublisher:
+    """Rate-caps tally broadcasts per battle, always sending the latest state."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._latest: Dict[str, Dict[str, int]] = {}
+        self._last_sent: Dict[str, float] = {}
+        self._scheduled: Dict[str, asyncio.Task] = {}
+
+    def schedule(self, battle_id: str, tally: Dict[str, int]) -> None:
+        """Note a new tally; it is broadcast now or when the interval allows."""
+        self._latest[battle_id] = tally
+        if battle_id in self._scheduled:
+            return
+        loop = asyncio.get_running_loop()
+        last_sent = self._last_sent.get(battle_id)
+        delay = 0.0 if last_sent is None else max(0.0, last_sent + self.interval - loop.time())
+        self._scheduled[battle_id] = asyncio.create_task(self._publish_later(battle_id, delay))
+
+    async def flush(self, battle_id: str) -> None:
+        """Broadcast a battle's tally right away, e.g. when it closes."""
+        task = self._scheduled.pop(battle_id, None)
+        if task is not None:
+            task.cancel()
+        await self._publish(battle_id)
+        self._last_sent.pop(battle_id, None)
+
+    async def close(self) -> None:
+        """Send every pending broadcast."""
+        for battle_id in list(self._scheduled):
+            await self.flush(battle_id)
+
+    async def _publish_later(self, battle_id: str, delay: float) -> None:
+        if delay:
+            await asyncio.sleep(delay)
+        self._scheduled.pop(battle_id, None)
+        try:
+            await self._publish(battle_id)
+        except Exception as e:
+            logger.warning("Tally publish failed for battle %s: %s", battle_id, e)
+
+    async def _publish(self, battle_id: str) -> None:
+        self._last_sent[battle_id] = asyncio.get_running_loop().time()
+        tally = self._latest.pop(battle_id, None)
+        # The shared counters include votes taken by other workers
+        if settings.redis_tallies and await redis_client.publish_counts(battle_id):
+            return
+        if tally is not None:
+            await redis_client.publish_tally(battle_id, tally)
+
+
+# Global tally publisher instance
+tally_publisher = TallyPublisher(interval=settings.tally_publish_interval_ms / 1000)
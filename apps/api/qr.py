@@ -0,0 +1,91 @@
+"""Cached QR code rendering.
+
+A battle's QR code only depends on its URL, yet projector reloads and flyer rushes
+used to rebuild and PNG-encode it on every hit, on the event loop. PNGs are now
+rendered once per (url, size) in a worker thread and kept in a small LRU.
+"""
+
+import asyncio
+import base64
+from collections import OrderedDict
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Dict, Tuple
+
+from config import settings
+from http_cache import content_etag
+
+
+@dataclass(frozen=True)
+class QRCodeImage:
+    """A rendered QR code PNG."""
+    png: bytes
+    etag: str
+
+    @property
+    def data_url(self) -> str:
+        return f"data:image/png;base64,{base64.b64encode(self.png).decode()}"
+
+
+def battle_url(battle_id: str) -> str:
+    """Public voting page URL for a battle."""
+    return f"{settings.web_base_url.rstrip('/')}/battle/{battle_id}"
+
+
+def _render(url: str, box_size: int) -> QRCodeImage:
+    import qrcode  # PIL is heavy; only load it once a QR code is requested
+
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=box_size,
+        border=4,
+    )
+    qr.add_data(url)
+    qr.make(fit=True)
+    buffer = BytesIO()
+    qr.make_image(fill_color="black", back_color="white").save(buffer, format="PNG")
+    png = buffer.getvalue()
+    return QRCodeImage(png=png, etag=content_etag(png))
+
+
+class QRRenderer:
+    """Renders QR code PNGs off the event loop and remembers the most recent ones."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._images: "OrderedDict[Tuple[str, int], QRCodeImage]" = OrderedDict()
+        self._rendering: Dict[Tuple[str, int], asyncio.Future] = {}
+
+    async def render(self, url: str, box_size: int = 10) -> QRCodeImage:
+        """Get the PNG for `url`, rendering it in a thread on a cache miss."""
+        key = (url, box_size)
+        image = self._images.get(key)
+        if image is not None:
+            self._images.move_to_end(key)
+            return image
+
+        # Let concurrent misses share one render
+        rendering = self._rendering.get(key)
+        if rendering is not None:
+            return await asyncio.shield(rendering)
+
+        future = asyncio.get_running_loop().create_future()
+        self._rendering[key] = future
+        try:
+            image = await asyncio.to_thread(_render, url, box_size)
+            self._images[key] = image
+            if len(self._images) > self.max_size:
+                self._images.popitem(last=False)
+            future.set_result(image)
+            return image
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            del self._rendering[key]
+
+
+# Global QR renderer instance
+qr_renderer = QRRenderer(max_size=settings.qr_cache_size)
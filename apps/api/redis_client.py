@@ -1,10 +1,167 @@
 """Redis client for caching and pub/sub."""
 
 import json
+import uuid
 import redis.asyncio as redis
-from typing import Dict, Any, Optional
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional, Sequence, Tuple
 
 from config import settings
+from metrics import timed_redis
+
+
+# Field of a battle's counters hash holding its tally version. The version moves
+# whenever the counts do, so (battle, version) identifies a tally; a recreated
+# hash starts from the current time in ms so versions never repeat after expiry.
+TALLY_VERSION_FIELD = "version"
+
+# Mirror a battle's battle_tallies rows into its counters. Each choice's count is
+# only written if its row version is newer than the one mirrored last, so writes
+# may arrive in any order (or twice) and the newest committed count still wins.
+# KEYS are the counters and their row versions; ARGV is the TTL followed by
+# (choice, count, version) triples covering every choice. Returns whether any
+# count changed, then the counters.
+_SYNC_COUNTS = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    redis.call('DEL', KEYS[2])
+end
+local changed = 0
+for i = 2, #ARGV, 3 do
+    local mirrored = tonumber(redis.call('HGET', KEYS[2], ARGV[i]) or '-1')
+    if tonumber(ARGV[i + 2]) > mirrored then
+        redis.call('HSET', KEYS[2], ARGV[i], ARGV[i + 2])
+        if redis.call('HGET', KEYS[1], ARGV[i]) ~= ARGV[i + 1] then
+            redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+            changed = 1
+        end
+    end
+end
+if changed == 1 then
+    if redis.call('HEXISTS', KEYS[1], 'version') == 1 then
+        redis.call('HINCRBY', KEYS[1], 'version', 1)
+    else
+        local time = redis.call('TIME')
+        redis.call('HSET', KEYS[1], 'version', time[1] .. string.format('%03d', math.floor(tonumber(time[2]) / 1000)))
+    end
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+return {changed, redis.call('HGETALL', KEYS[1])}
+"""
+
+# Live updates (tallies and battle status changes) are appended to a capped
+# stream per battle and published as "<entry id> <json>", so SSE streams can
+# send the entry id and a reconnecting client can resume from the stream.
+# KEYS[1] is the stream; ARGV is the cap, the TTL, the update type, its JSON
+# and the pub/sub channel. Returns the entry id.
+_APPEND_UPDATE = """
+local id = redis.call('XADD', KEYS[1], 'MAXLEN', '~', ARGV[1], '*', 'type', ARGV[3], 'data', ARGV[4])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+redis.call('PUBLISH', ARGV[5], id .. ' ' .. ARGV[4])
+return id
+"""
+
+# Publish a battle's live counters straight from Redis, without a read round trip.
+# KEYS are the counters and the update stream; ARGV is the channel, cap and TTL.
+_PUBLISH_COUNTS = """
+local flat = redis.call('HGETALL', KEYS[1])
+if #flat == 0 then
+    return 0
+end
+local counts = {}
+for i = 1, #flat, 2 do
+    counts[flat[i]] = tonumber(flat[i + 1])
+end
+local data = cjson.encode(counts)
+local id = redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[2], '*', 'type', 'tally', 'data', data)
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+redis.call('PUBLISH', ARGV[1], id .. ' ' .. data)
+return 1
+"""
+
+# Sliding-window rate limit over several dimensions in one round trip.
+# KEYS[1] is the event's override hash; KEYS[2..] are one sorted-set log per
+# dimension. ARGV is the member id, the default window (ms), then a
+# (dimension, default limit) pair per log. An attempt is only logged if every
+# dimension allows it; otherwise the longest wait (ms) is returned.
+_RATE_LIMIT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local overrides = {}
+local raw = redis.call('HGETALL', KEYS[1])
+for i = 1, #raw, 2 do
+    overrides[raw[i]] = tonumber(raw[i + 1])
+end
+local window = tonumber(ARGV[2])
+if overrides['window'] then
+    window = overrides['window'] * 1000
+end
+local limits = {}
+local retry_after = 0
+for i = 2, #KEYS do
+    local dimension = ARGV[2 * i - 1]
+    local limit = overrides[dimension] or tonumber(ARGV[2 * i])
+    limits[i] = limit
+    if limit > 0 then
+        redis.call('ZREMRANGEBYSCORE', KEYS[i], '-inf', now - window)
+        local count = redis.call('ZCARD', KEYS[i])
+        if count >= limit then
+            -- A slot frees up when the entry `limit` places from the newest expires
+            local entry = redis.call('ZRANGE', KEYS[i], count - limit, count - limit, 'WITHSCORES')
+            local wait = tonumber(entry[2]) + window - now
+            if wait > retry_after then
+                retry_after = wait
+            end
+        end
+    end
+end
+if retry_after > 0 then
+    return retry_after
+end
+for i = 2, #KEYS do
+    if limits[i] > 0 then
+        redis.call('ZADD', KEYS[i], now, ARGV[1])
+        redis.call('PEXPIRE', KEYS[i], window)
+    end
+end
+return 0
+"""
+
+RATE_LIMIT_DIMENSIONS = ("ip", "device", "event")
+
+
+@dataclass(frozen=True)
+class RateLimitResult:
+    """Outcome of a rate limit check."""
+    allowed: bool
+    retry_after: int = 0  # seconds until a retry can succeed
+
+
+def _pairs_to_counts(flat: list) -> Dict[str, int]:
+    """Convert a flat HGETALL reply into a counts dict."""
+    return {flat[i]: int(flat[i + 1]) for i in range(0, len(flat), 2)}
+
+
+def parse_update(message: str) -> Tuple[str, str]:
+    """Split a published live update into its stream entry id and JSON."""
+    entry_id, _, data = message.partition(" ")
+    return entry_id, data
+
+
+def update_position(entry_id: str) -> Optional[Tuple[int, int]]:
+    """Sortable (ms, seq) form of a stream entry id, or None if malformed."""
+    ms, _, seq = entry_id.partition("-")
+    if not (ms.isdigit() and seq.isdigit()):
+        return None
+    return int(ms), int(seq)
+
+
+@dataclass(frozen=True)
+class BattleUpdate:
+    """One entry of a battle's update stream."""
+    id: str
+    type: str  # "tally" or "status"
+    data: str
 
 
 class RedisClient:
@@ -12,7 +169,12 @@ class RedisClient:
     
     def __init__(self):
         self.redis = redis.from_url(settings.redis_url, decode_responses=True)
+        self._sync_counts = self.redis.register_script(_SYNC_COUNTS)
+        self._rate_limit = self.redis.register_script(_RATE_LIMIT)
+        self._publish_counts = self.redis.register_script(_PUBLISH_COUNTS)
+        self._append_update = self.redis.register_script(_APPEND_UPDATE)
     
+    @timed_redis
     async def get_tally(self, battle_id: str) -> Optional[Dict[str, int]]:
         """Get tally from Redis cache."""
         key = f"battle:{battle_id}:tally"
@@ -21,30 +183,150 @@ class RedisClient:
             return json.loads(data)
         return None
     
+    @timed_redis
     async def set_tally(self, battle_id: str, tally: Dict[str, int]) -> None:
         """Set tally in Redis cache."""
         key = f"battle:{battle_id}:tally"
         await self.redis.setex(key, 10, json.dumps(tally))  # 10 seconds TTL
     
-    async def increment_vote(self, battle_id: str, choice: str) -> int:
-        """Increment vote counter in Redis."""
-        key = f"battle:{battle_id}:{choice}"
-        return await self.redis.incr(key)
+    @timed_redis
+    async def get_counts(self, battle_id: str) -> Optional[Dict[str, int]]:
+        """Get live vote counters and their version, or None if not seeded."""
+        key = f"battle:{battle_id}:counts"
+        data = await self.redis.hgetall(key)
+        if not data:
+            return None
+        return {choice: int(count) for choice, count in data.items()}
+    
+    @timed_redis
+    async def sync_counts(
+        self, tallies: Dict[str, Sequence[Tuple[str, int, int]]]
+    ) -> Dict[str, Tuple[Dict[str, int], bool]]:
+        """Mirror battles' (choice, count, row version) rows into the live counters.
+        
+        All battles go out in one pipeline. Returns each battle's counters,
+        including their version, and whether any count changed.
+        """
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for battle_id, rows in tallies.items():
+                args = [settings.tally_counts_ttl]
+                for choice, count, version in rows:
+                    args.extend([choice, count, version])
+                await self._sync_counts(
+                    keys=[f"battle:{battle_id}:counts", f"battle:{battle_id}:count_versions"],
+                    args=args,
+                    client=pipe,
+                )
+            results = await pipe.execute()
+        return {
+            battle_id: (_pairs_to_counts(counts), bool(changed))
+            for battle_id, (changed, counts) in zip(tallies, results)
+        }
+    
+    @timed_redis
+    async def publish_counts(self, battle_id: str) -> bool:
+        """Publish the live counters as a tally update; False if not seeded."""
+        result = await self._publish_counts(
+            keys=[f"battle:{battle_id}:counts", f"battle:{battle_id}:updates"],
+            args=[f"battle:{battle_id}:tally", settings.sse_replay_length, settings.tally_counts_ttl],
+        )
+        return bool(result)
     
+    @timed_redis
     async def publish_tally(self, battle_id: str, tally: Dict[str, int]) -> None:
         """Publish tally update to Redis channel."""
-        channel = f"battle:{battle_id}:tally"
-        await self.redis.publish(channel, json.dumps(tally))
+        await self._append_update(
+            keys=[f"battle:{battle_id}:updates"],
+            args=[
+                settings.sse_replay_length, settings.tally_counts_ttl,
+                "tally", json.dumps(tally), f"battle:{battle_id}:tally",
+            ],
+        )
     
-    async def check_rate_limit(self, ip_address: str) -> bool:
-        """Check if IP has exceeded rate limit."""
-        key = f"rate_limit:{ip_address}"
-        current_count = await self.redis.incr(key)
+    @timed_redis
+    async def publish_battle_status(self, battle_id: str, event_id: str, battle: str) -> None:
+        """Publish a battle's new state (JSON) to its event's channel."""
+        await self._append_update(
+            keys=[f"battle:{battle_id}:updates"],
+            args=[
+                settings.sse_replay_length, settings.tally_counts_ttl,
+                "status", battle, f"event:{event_id}:battles",
+            ],
+        )
+    
+    @timed_redis
+    async def last_battle_update_id(self, battle_id: str) -> str:
+        """Id of the newest entry in a battle's update stream ("0-0" if none)."""
+        entries = await self.redis.xrevrange(f"battle:{battle_id}:updates", count=1)
+        return entries[0][0] if entries else "0-0"
+    
+    @timed_redis
+    async def read_battle_updates(self, battle_id: str, after: str) -> Optional[List[BattleUpdate]]:
+        """Entries of a battle's update stream newer than `after`.
+        
+        Returns None when the caller cannot resume from `after`: it is not an
+        entry id, the stream is gone (expired or never written), or the cap has
+        trimmed the stream past it, so updates after it may be lost.
+        """
+        position = update_position(after)
+        if position is None:
+            return None
+        key = f"battle:{battle_id}:updates"
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.xrange(key, count=1)
+            pipe.xrange(key, min=f"({after}")
+            oldest, entries = await pipe.execute()
+        if not oldest or position < update_position(oldest[0][0]):
+            return None
+        return [BattleUpdate(id=entry_id, type=fields["type"], data=fields["data"]) for entry_id, fields in entries]
+    
+    @timed_redis
+    async def check_rate_limit(
+        self,
+        ip_address: str,
+        device_hash: Optional[str] = None,
+        event_id: Optional[str] = None,
+    ) -> RateLimitResult:
+        """Count a vote attempt against the configured sliding-window limits.
         
-        if current_count == 1:
-            await self.redis.expire(key, settings.rate_limit_window)
+        Limits apply per `settings.rate_limit_keys` dimension and can be
+        overridden per event with `set_rate_limit_overrides`.
+        """
+        values = {"ip": ip_address, "device": device_hash, "event": event_id}
+        defaults = {
+            "ip": settings.ip_rate_limit,
+            "device": settings.device_rate_limit,
+            "event": settings.event_rate_limit,
+        }
+        keys = [f"rate_limit:overrides:{event_id}"]
+        args = [uuid.uuid4().hex, settings.rate_limit_window * 1000]
+        for dimension in settings.rate_limit_keys.split(","):
+            dimension = dimension.strip()
+            if dimension not in RATE_LIMIT_DIMENSIONS or not values[dimension]:
+                continue
+            keys.append(f"rate_limit:{dimension}:{values[dimension]}")
+            args.extend([dimension, defaults[dimension]])
         
-        return current_count <= settings.ip_rate_limit
+        retry_after_ms = int(await self._rate_limit(keys=keys, args=args))
+        if retry_after_ms > 0:
+            return RateLimitResult(allowed=False, retry_after=-(-retry_after_ms // 1000))
+        return RateLimitResult(allowed=True)
+    
+    @timed_redis
+    async def get_rate_limit_overrides(self, event_id: str) -> Dict[str, int]:
+        """Get an event's rate limit overrides."""
+        data = await self.redis.hgetall(f"rate_limit:overrides:{event_id}")
+        return {name: int(value) for name, value in data.items()}
+    
+    @timed_redis
+    async def set_rate_limit_overrides(self, event_id: str, overrides: Dict[str, int]) -> None:
+        """Replace an event's rate limit overrides (dimension limits and/or window)."""
+        key = f"rate_limit:overrides:{event_id}"
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            if overrides:
+                pipe.hset(key, mapping=overrides)
+            await pipe.execute()
     
     async def close(self) -> None:
         """Close Redis connection."""
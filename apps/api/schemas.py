@@ -35,6 +35,7 @@ class TallyResponse(BaseModel):
     A: int
     B: int
     REPLICA: int
+    version: Optional[int] = None  # moves with every change to the counts (live tallies only)
 
 
 class VoteResponse(BaseModel):
@@ -59,6 +60,14 @@ class AdminOpenBattleRequest(BaseModel):
     ends_at: Optional[datetime] = None
 
 
+class AdminRateLimitRequest(BaseModel):
+    """Admin per-event rate limit override schema (0 disables a dimension)."""
+    ip: Optional[int] = Field(None, ge=0)
+    device: Optional[int] = Field(None, ge=0)
+    event: Optional[int] = Field(None, ge=0)
+    window: Optional[int] = Field(None, gt=0)
+
+
 class HealthResponse(BaseModel):
     """Health check response schema."""
     status: str
@@ -0,0 +1,86 @@
+"""Server-Sent Events plumbing shared by the live stream endpoints.
+
+Every open stream costs a socket, a generator and a hub queue for as long as the
+phone stays on the page, so each worker admits at most `sse_max_streams` at a
+time. The rest get a 200 stream that only sets `retry:` and ends, because
+EventSource reconnects after that delay but gives up for good on an error
+status. Idle streams send a `:heartbeat` comment so proxies keep them open and
+dead clients are noticed on the next write.
+"""
+
+import asyncio
+from typing import Optional
+
+from fastapi.responses import StreamingResponse
+
+import metrics
+from config import settings
+from hub import LatestQueue, Message
+
+HEARTBEAT = ":heartbeat\n\n"
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "Access-Control-Allow-Origin": "*",
+}
+
+
+class StreamSlots:
+    """Counts open SSE streams against the per-process cap."""
+
+    def __init__(self, max_streams: int):
+        self.max_streams = max_streams
+        self.open = 0
+
+    def acquire(self) -> bool:
+        """Take a slot; False when the process is already at its cap."""
+        if self.open >= self.max_streams:
+            metrics.sse_streams_rejected_total.inc()
+            return False
+        self.open += 1
+        metrics.sse_streams.inc()
+        return True
+
+    def release(self) -> None:
+        self.open -= 1
+        metrics.sse_streams.dec()
+
+
+# Global stream slot counter
+stream_slots = StreamSlots(max_streams=settings.sse_max_streams)
+
+
+async def shed_stream():
+    """A stream that tells EventSource to reconnect later, then ends."""
+    yield f"retry: {settings.sse_retry_after * 1000}\n\n"
+
+
+class EventStreamResponse(StreamingResponse):
+    """A text/event-stream response holding one stream slot until it ends.
+
+    At the cap `content` is never started and the client gets `shed_stream()`
+    instead. The slot is released when the ASGI call returns, which also covers
+    a client that disconnects before the generator's first step.
+    """
+
+    def __init__(self, content):
+        self.holds_slot = stream_slots.acquire()
+        if not self.holds_slot:
+            content = shed_stream()
+        super().__init__(content, media_type="text/event-stream", headers=SSE_HEADERS)
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if self.holds_slot:
+                stream_slots.release()
+
+
+async def next_message(queue: LatestQueue) -> Optional[Message]:
+    """Next message from `queue`, or None once the heartbeat interval passes idle."""
+    try:
+        return await asyncio.wait_for(queue.get(), settings.sse_heartbeat_interval)
+    except asyncio.TimeoutError:
+        return None
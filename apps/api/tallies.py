@@ -0,0 +1,169 @@
+"""Live tally bookkeeping.
+
+Postgres keeps the vote rows, plus per-battle totals (`battle_tallies`) moved in
+the same transaction, and stays the source of truth. Redis holds a mirror of
+those totals per battle so reads cost O(1) however large the crowd is. Each
+mirrored count carries its row's version and Redis refuses older versions, so
+the vote path, cache misses and the background reconciler can all write the
+mirror at any time without losing or double-counting a vote.
+"""
+
+import asyncio
+import json
+import logging
+from typing import Dict, List, Sequence, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from database import AsyncSessionLocal
+from http_cache import content_etag
+from hub import pubsub_hub
+from models import Battle, BattleStatus, BattleTally, VoteChoice
+from redis_client import parse_update, redis_client
+from schemas import TallyResponse
+from votes import TallyRow, read_tallies
+
+logger = logging.getLogger(__name__)
+
+
+async def count_votes(battle_id: str, db: AsyncSession) -> Dict[str, int]:
+    """Read a battle's vote counts per choice from the materialized tallies."""
+    result = await db.execute(
+        select(BattleTally.choice, BattleTally.count).filter(BattleTally.battle_id == battle_id)
+    )
+
+    tally = {choice.value: 0 for choice in VoteChoice}
+    for choice, count in result.all():
+        # choice is a VoteChoice enum, get its value
+        choice_value = choice.value if hasattr(choice, 'value') else str(choice)
+        tally[choice_value] = count
+    return tally
+
+
+async def get_tallies_from_db(battle_id: str, db: AsyncSession) -> TallyResponse:
+    """Get tallies from database."""
+    tally = await count_votes(battle_id, db)
+
+    # Cache the result
+    await redis_client.set_tally(battle_id, tally)
+
+    return TallyResponse(**tally)
+
+
+async def get_live_tally(battle_id: str, db: AsyncSession) -> TallyResponse:
+    """Get current tallies, served from the Redis counters when enabled.
+
+    `battle_id` must be canonical (see `votes.canonical_id`): it names the
+    Redis keys, and the mirrored rows come back keyed by it.
+    """
+    if not settings.redis_tallies:
+        return await get_tallies_from_db(battle_id, db)
+
+    counts = await redis_client.get_counts(battle_id)
+    if counts is None:
+        counts, _ = (await mirror_tallies(await read_tallies(db, [battle_id])))[battle_id]
+    return TallyResponse(**counts)
+
+
+async def wait_for_tally(battle_id: str, since: int, db: AsyncSession, timeout: float) -> TallyResponse:
+    """Long-poll: return the tally once its version differs from `since`.
+
+    Waits on the battle's tally channel, so parked requests cost nothing until
+    an update is published; after `timeout` the unchanged tally is returned.
+    Without a version (Redis tallies off) the current tally returns right away.
+    """
+    # Subscribe before reading so no update falls between the two
+    async with pubsub_hub.subscribe(f"battle:{battle_id}:tally") as updates:
+        tally = await get_live_tally(battle_id, db)
+        # Don't keep a pooled connection while parked
+        await db.close()
+        if tally.version is None or tally.version != since:
+            return tally
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return tally
+            try:
+                _, message = await asyncio.wait_for(updates.get(), remaining)
+            except asyncio.TimeoutError:
+                return tally
+            try:
+                update = TallyResponse(**json.loads(parse_update(message)[1]))
+            except (TypeError, ValueError):
+                continue
+            if update.version != since:
+                return update
+
+
+def tally_etag(tally: TallyResponse) -> str:
+    """ETag for a tally: its version when live, else a hash of the counts."""
+    if tally.version is not None:
+        return f'"{tally.version}"'
+    return content_etag(tally.model_dump_json().encode())
+
+
+async def mirror_tallies(rows: Sequence[TallyRow]) -> Dict[str, Tuple[Dict[str, int], bool]]:
+    """Write battle_tallies rows to the Redis mirror in one pipeline.
+
+    Returns each battle's live counters and whether they changed.
+    """
+    tallies: Dict[str, List[Tuple[str, int, int]]] = {}
+    for row in rows:
+        tallies.setdefault(row.battle_id, []).append((row.choice, row.count, row.version))
+    return await redis_client.sync_counts(tallies)
+
+
+async def record_tallies(rows: Sequence[TallyRow]) -> Dict[str, TallyResponse]:
+    """Publish a committed batch's battle_tallies rows to the live tallies.
+
+    Returns the tally of each battle in the rows.
+    """
+    if not settings.redis_tallies:
+        tallies: Dict[str, Dict[str, int]] = {}
+        for row in rows:
+            tallies.setdefault(row.battle_id, {})[row.choice] = row.count
+        for battle_id, tally in tallies.items():
+            await redis_client.set_tally(battle_id, tally)
+        return {battle_id: TallyResponse(**tally) for battle_id, tally in tallies.items()}
+
+    mirrored = await mirror_tallies(rows)
+    return {battle_id: TallyResponse(**counts) for battle_id, (counts, _) in mirrored.items()}
+
+
+async def _open_battle_ids() -> List[str]:
+    """List the battles currently open for voting."""
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(Battle.id).filter(Battle.status == BattleStatus.OPEN))
+        return [str(battle_id) for battle_id in result.scalars()]
+
+
+async def reconcile_tallies() -> None:
+    """Bring the Redis counters of open battles back in line with Postgres.
+
+    Repairs counters that missed an update (e.g. Redis was unreachable right
+    after a commit). Counts already mirrored at the same or a newer version are
+    left alone, so this never undoes a vote that landed meanwhile.
+    """
+    battle_ids = await _open_battle_ids()
+    if not battle_ids:
+        return
+    async with AsyncSessionLocal() as db:
+        rows = await read_tallies(db, battle_ids)
+    for battle_id, (counts, changed) in (await mirror_tallies(rows)).items():
+        if changed:
+            logger.info("Reconciled tally for battle %s: %s", battle_id, counts)
+
+
+async def run_tally_reconciler() -> None:
+    """Periodically reconcile live tallies until cancelled."""
+    while True:
+        await asyncio.sleep(settings.tally_reconcile_interval)
+        try:
+            await reconcile_tallies()
+        except Exception as e:
+            logger.warning("Tally reconciliation failed: %s", e)
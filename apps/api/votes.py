@@ -0,0 +1,260 @@
+"""Vote persistence."""
+
+import ipaddress
+import uuid
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import VoteChoice
+
+
+# Insert or change many devices' votes in one round trip. The `previous` CTE reads
+# the pre-statement snapshot, so it reports the choice each upsert replaced.
+# Re-sending the current choice matches no row in DO UPDATE and writes nothing.
+# Rows are inserted in key order so concurrent batches lock rows in the same order.
+_UPSERT_VOTES = text("""
+    WITH incoming AS (
+        SELECT * FROM unnest(
+            CAST(:battle_ids AS uuid[]),
+            CAST(:choices AS votechoice[]),
+            CAST(:device_hashes AS text[]),
+            CAST(:ip_addresses AS inet[])
+        ) AS t(battle_id, choice, device_hash, ip_address)
+    ), previous AS (
+        SELECT v.battle_id, v.device_hash, v.choice
+        FROM votes v
+        JOIN incoming i ON i.battle_id = v.battle_id AND i.device_hash = v.device_hash
+    ), upserted AS (
+        INSERT INTO votes (battle_id, choice, device_hash, ip_address)
+        SELECT battle_id, choice, device_hash, ip_address
+        FROM incoming
+        ORDER BY battle_id, device_hash
+        ON CONFLICT ON CONSTRAINT unique_battle_device_vote DO UPDATE
+            SET choice = EXCLUDED.choice
+            WHERE votes.choice IS DISTINCT FROM EXCLUDED.choice
+        RETURNING battle_id, device_hash, xmax = 0 AS inserted
+    )
+    SELECT i.battle_id, i.device_hash, u.inserted, p.choice AS previous_choice
+    FROM incoming i
+    LEFT JOIN upserted u ON u.battle_id = i.battle_id AND u.device_hash = i.device_hash
+    LEFT JOIN previous p ON p.battle_id = i.battle_id AND p.device_hash = i.device_hash
+""")
+
+# Apply a batch's net count changes to the materialized tallies, in key order so
+# concurrent batches lock tally rows in the same order. Every change bumps the
+# row's version, which orders the row's writes to the Redis mirror.
+_APPLY_TALLY_DELTAS = text("""
+    INSERT INTO battle_tallies (battle_id, choice, count, version)
+    SELECT battle_id, choice, delta, 1
+    FROM unnest(
+        CAST(:battle_ids AS uuid[]),
+        CAST(:choices AS votechoice[]),
+        CAST(:deltas AS bigint[])
+    ) AS t(battle_id, choice, delta)
+    ORDER BY battle_id, choice
+    ON CONFLICT (battle_id, choice) DO UPDATE
+        SET count = battle_tallies.count + EXCLUDED.count,
+            version = battle_tallies.version + 1
+""")
+
+# Recount battles' tallies from their vote rows. Every tally row is created and
+# locked first, so tally writers still in flight either finish before the count
+# (and are included) or apply their deltas on top of it afterwards.
+_LOCK_TALLIES = text("""
+    INSERT INTO battle_tallies (battle_id, choice, count, version)
+    SELECT battle_id, choice, 0, 0
+    FROM unnest(CAST(:battle_ids AS uuid[])) AS b(battle_id)
+    CROSS JOIN unnest(enum_range(NULL::votechoice)) AS c(choice)
+    ORDER BY battle_id, choice
+    ON CONFLICT (battle_id, choice) DO NOTHING
+""")
+_SELECT_TALLIES_FOR_UPDATE = text("""
+    SELECT 1 FROM battle_tallies
+    WHERE battle_id = ANY(CAST(:battle_ids AS uuid[]))
+    ORDER BY battle_id, choice
+    FOR UPDATE
+""")
+_RECOUNT_TALLIES = text("""
+    UPDATE battle_tallies t
+    SET count = (
+        SELECT count(*) FROM votes v
+        WHERE v.battle_id = t.battle_id AND v.choice = t.choice
+    ),
+        version = t.version + 1
+    WHERE t.battle_id = ANY(CAST(:battle_ids AS uuid[]))
+""")
+_READ_TALLIES = text("""
+    SELECT battle_id, choice, count, version FROM battle_tallies
+    WHERE battle_id = ANY(CAST(:battle_ids AS uuid[]))
+""")
+
+
+@dataclass(frozen=True)
+class VoteRow:
+    """A vote waiting to be written."""
+    battle_id: str
+    choice: str
+    device_hash: str
+    ip_address: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class VoteWrite:
+    """Outcome of writing one device's vote."""
+    choice: str
+    previous_choice: Optional[str]  # None if this is the device's first vote
+    changed: bool  # False if the device re-sent its current choice
+    exact: bool = True  # False if a concurrent write hid the replaced choice
+
+
+@dataclass(frozen=True)
+class TallyRow:
+    """A battle's materialized count for one choice, at a row version."""
+    battle_id: str
+    choice: str
+    count: int
+    version: int
+
+
+def canonical_id(battle_id) -> str:
+    """A battle id as Postgres spells it (lower-case, hyphenated), which keys results."""
+    return str(uuid.UUID(str(battle_id)))
+
+
+def normalize_ip(ip_address: Optional[str]) -> Optional[str]:
+    """Return the address if Postgres can store it as INET, else None."""
+    if not ip_address:
+        return None
+    try:
+        return str(ipaddress.ip_address(ip_address))
+    except ValueError:
+        return None
+
+
+async def recount_tallies(db: AsyncSession, battle_ids: Sequence[str]) -> None:
+    """Rebuild battles' materialized tallies from their votes.
+
+    The caller owns the transaction and must commit.
+    """
+    params = {"battle_ids": sorted({canonical_id(battle_id) for battle_id in battle_ids})}
+    await db.execute(_LOCK_TALLIES, params)
+    await db.execute(_SELECT_TALLIES_FOR_UPDATE, params)
+    await db.execute(_RECOUNT_TALLIES, params)
+
+
+async def read_tallies(db: AsyncSession, battle_ids: Sequence[str]) -> List[TallyRow]:
+    """Read battles' materialized tallies, one row per choice.
+
+    Choices nobody has voted for yet come back as count 0 at version 0. Any
+    (count, version) pair read is one that was committed, so the rows can be
+    mirrored to Redis whenever they are read.
+    """
+    ids = sorted({canonical_id(battle_id) for battle_id in battle_ids})
+    result = await db.execute(_READ_TALLIES, {"battle_ids": ids})
+    stored = {
+        (str(battle_id), getattr(choice, "value", choice)): (count, version)
+        for battle_id, choice, count, version in result
+    }
+    return [
+        TallyRow(battle_id, choice.value, *stored.get((battle_id, choice.value), (0, 0)))
+        for battle_id in ids
+        for choice in VoteChoice
+    ]
+
+
+async def _apply_tally_deltas(db: AsyncSession, rows: Sequence[VoteRow], writes: Sequence[VoteWrite]) -> None:
+    """Move the materialized tallies by what a batch of writes changed."""
+    deltas: Dict[Tuple[str, str], int] = {}
+    recount = set()
+    for row, write in zip(rows, writes):
+        battle_id = canonical_id(row.battle_id)
+        if not write.exact:
+            recount.add(battle_id)
+            continue
+        if not write.changed:
+            continue
+        deltas[(battle_id, write.choice)] = deltas.get((battle_id, write.choice), 0) + 1
+        if write.previous_choice is not None:
+            key = (battle_id, write.previous_choice)
+            deltas[key] = deltas.get(key, 0) - 1
+
+    # A recount supersedes the deltas of its battle
+    deltas = {key: delta for key, delta in deltas.items() if delta and key[0] not in recount}
+    if deltas:
+        await db.execute(_APPLY_TALLY_DELTAS, {
+            "battle_ids": [battle_id for battle_id, _ in deltas],
+            "choices": [choice for _, choice in deltas],
+            "deltas": list(deltas.values()),
+        })
+    if recount:
+        await recount_tallies(db, recount)
+
+
+async def upsert_votes(db: AsyncSession, rows: Sequence[VoteRow]) -> List[VoteWrite]:
+    """Insert or update many votes in one statement, in submission order.
+
+    Returns one VoteWrite per row. When the same device votes several times in
+    one batch only its last choice is written, and each of its rows reports the
+    choice the row before it replaced, so per-row tally deltas still add up.
+    The materialized `battle_tallies` move in the same transaction. The caller
+    owns the transaction and must commit.
+    """
+    # Last choice per device wins; dicts keep first-seen key order
+    latest: Dict[Tuple[str, str], VoteRow] = {}
+    for row in rows:
+        latest[(canonical_id(row.battle_id), row.device_hash)] = row
+
+    result = await db.execute(_UPSERT_VOTES, {
+        "battle_ids": [battle_id for battle_id, _ in latest],
+        "choices": [row.choice for row in latest.values()],
+        "device_hashes": [device_hash for _, device_hash in latest],
+        "ip_addresses": [normalize_ip(row.ip_address) for row in latest.values()],
+    })
+
+    # What each device held before this batch, and whether that is certain
+    stored: Dict[Tuple[str, str], Tuple[Optional[str], bool]] = {}
+    for battle_id, device_hash, inserted, previous_choice in result:
+        key = (str(battle_id), device_hash)
+        if inserted is None:
+            # Nothing written: the device already held the choice we sent
+            stored[key] = (latest[key].choice, True)
+        elif inserted:
+            stored[key] = (None, True)
+        else:
+            # Updated a row our snapshot didn't see: another request from the
+            # same device inserted it concurrently, so what it held is unknown.
+            stored[key] = (previous_choice, previous_choice is not None)
+
+    writes = []
+    for row in rows:
+        key = (canonical_id(row.battle_id), row.device_hash)
+        previous_choice, exact = stored[key]
+        writes.append(VoteWrite(
+            choice=row.choice,
+            previous_choice=previous_choice,
+            changed=previous_choice != row.choice or not exact,
+            exact=exact,
+        ))
+        stored[key] = (row.choice, True)
+
+    await _apply_tally_deltas(db, rows, writes)
+    return writes
+
+
+async def upsert_vote(
+    db: AsyncSession,
+    battle_id: str,
+    choice: str,
+    device_hash: str,
+    ip_address: Optional[str] = None,
+) -> VoteWrite:
+    """Insert or update a device's vote, reporting the choice it replaced.
+
+    The caller owns the transaction and must commit.
+    """
+    row = VoteRow(battle_id=battle_id, choice=choice, device_hash=device_hash, ip_address=ip_address)
+    writes = await upsert_votes(db, [row])
+    return writes[0]
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Apply database migrations. Run once per deploy, before any API worker starts;
+the API itself never touches the schema.
+
+    python infra/db/migrate.py                  # upgrade to the latest revision
+    python infra/db/migrate.py current          # show the applied revision
+    python infra/db/migrate.py downgrade 0002
+
+Databases that the API used to set up itself at import time have tables but no
+alembic_version; they are stamped at 0001 first and the later revisions, which
+tolerate what create_all() already made, bring them up to date.
+"""
+
+import argparse
+import os
+import sys
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.pool import NullPool
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, '../../apps/api'))
+
+from config import settings  # noqa: E402
+
+# Revision matching the schema create_all() used to build before Alembic ran
+LEGACY_REVISION = '0001'
+
+
+def adopt_legacy_database(config: Config) -> None:
+    """Stamp a database created without Alembic so upgrades apply to it."""
+    engine = create_engine(settings.database_url, poolclass=NullPool)
+    try:
+        with engine.connect() as connection:
+            tables = inspect(connection)
+            legacy = tables.has_table('votes') and not tables.has_table('alembic_version')
+    finally:
+        engine.dispose()
+    if legacy:
+        print(f"Database has tables but no migration history; stamping {LEGACY_REVISION}")
+        command.stamp(config, LEGACY_REVISION)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', nargs='?', default='upgrade', choices=['upgrade', 'downgrade', 'current', 'history'])
+    parser.add_argument('revision', nargs='?', default='head')
+    args = parser.parse_args()
+
+    config = Config(os.path.join(HERE, 'alembic.ini'))
+    config.set_main_option('script_location', HERE)
+
+    if args.command == 'upgrade':
+        adopt_legacy_database(config)
+        command.upgrade(config, args.revision)
+    elif args.command == 'downgrade':
+        command.downgrade(config, args.revision)
+    elif args.command == 'current':
+        command.current(config, verbose=True)
+    else:
+        command.history(config)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""Materialized per-battle tallies
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2025-01-15 00:00:00.000000
+
+Adds battle_tallies (battle_id, choice, count), which the API moves in the same
+transaction as every vote write, and backfills it from the existing votes.
+Votes are locked against writes during the backfill; run this before starting
+API workers that read battle_tallies.
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Backfill from a consistent view of the votes
+    op.execute("LOCK TABLE votes IN SHARE MODE")
+    # The API used to create_all() at import, which may have made the table already
+    if sa.inspect(op.get_bind()).has_table('battle_tallies'):
+        op.execute("DELETE FROM battle_tallies")
+    else:
+        _create_table()
+    op.execute("""
+        INSERT INTO battle_tallies (battle_id, choice, count)
+        SELECT battle_id, choice, count(*)
+        FROM votes
+        GROUP BY battle_id, choice
+    """)
+
+
+def _create_table() -> None:
+    op.create_table('battle_tallies',
+        sa.Column('battle_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('choice', postgresql.ENUM(name='votechoice', create_type=False), nullable=False),
+        sa.Column('count', sa.BigInteger(), server_default='0', nullable=False),
+        sa.PrimaryKeyConstraint('battle_id', 'choice')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('battle_tallies')
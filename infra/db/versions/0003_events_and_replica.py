@@ -0,0 +1,39 @@
+"""Events table and REPLICA vote choice
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2025-01-20 00:00:00.000000
+
+Brings Alembic level with what the API used to create at import time: the
+events table and the REPLICA vote choice. Databases set up that way already have
+both, so each step checks first.
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    if not sa.inspect(op.get_bind()).has_table('events'):
+        op.create_table('events',
+            sa.Column('id', postgresql.UUID(as_uuid=True), nullable=False),
+            sa.Column('name', sa.String(), nullable=False),
+            sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+            sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+    # ALTER TYPE ... ADD VALUE cannot share a transaction with its first use
+    with op.get_context().autocommit_block():
+        op.execute("ALTER TYPE votechoice ADD VALUE IF NOT EXISTS 'REPLICA'")
+
+
+def downgrade() -> None:
+    # PostgreSQL cannot drop an enum value; REPLICA stays in votechoice
+    op.drop_table('events')
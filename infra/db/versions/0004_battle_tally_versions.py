@@ -0,0 +1,26 @@
+"""Versioned battle tallies
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2025-02-03 00:00:00.000000
+
+Adds battle_tallies.version, bumped with every change to a row's count in the
+same transaction. The Redis counters mirror (count, version) pairs and refuse
+older versions, so a late write can never overwrite a newer count.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('battle_tallies', sa.Column('version', sa.BigInteger(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('battle_tallies', 'version')
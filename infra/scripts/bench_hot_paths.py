@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the vote and tally hot paths.
+
+Runs in-process against the API modules, with the database and Redis from
+DATABASE_URL / REDIS_URL (or an in-process Redis with --fake-redis, which needs
+the fakeredis package). Benchmarks whose backend is unreachable are skipped.
+
+  vote                          POST /vote through the ASGI app, one vote at a time
+  vote_concurrent[50]           50 simultaneous votes (one op = the whole burst)
+  get_tallies_from_db[N]        tally read for a battle with N votes
+  recount_tallies[N]            full GROUP BY recount over N votes
+  verify_event_token[cached|uncached]
+  check_rate_limit
+  qr_render[cached|uncached]
+  sse_fanout[N]                 one tally update copied to N live stream queues
+
+Each benchmark is calibrated to batches of at least --min-time seconds and
+timed over --rounds batches. Results are compared against the baseline file
+(median per op); anything slower by more than --threshold is flagged and the
+exit status is 1. --save makes this run the new baseline.
+
+    python infra/scripts/bench_hot_paths.py --save
+    python infra/scripts/bench_hot_paths.py -k tallies --sizes 1000,100000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(HERE, '../../apps/api')
+DEFAULT_BASELINE = os.path.join(HERE, '../../.bench/hot_paths.json')
+
+Operation = Callable[[], Awaitable[None]]
+
+
+def use_fake_redis() -> None:
+    """Point redis.asyncio at one in-process fakeredis server (before the API is imported)."""
+    try:
+        import fakeredis
+    except ImportError:
+        sys.exit("--fake-redis needs the fakeredis package (pip install fakeredis)")
+    import redis.asyncio as aredis
+
+    server = fakeredis.FakeServer()
+
+    def from_url(url, **kwargs):
+        return fakeredis.FakeAsyncRedis(server=server, **kwargs)
+
+    aredis.from_url = from_url
+
+
+async def run_batch(operation: Operation, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        await operation()
+    return time.perf_counter() - started
+
+
+async def measure(operation: Operation, min_time: float, rounds: int) -> Dict[str, float]:
+    """Per-op timing statistics (seconds) over `rounds` calibrated batches."""
+    await operation()  # warm up caches, connections and code paths
+    iterations = 1
+    while True:
+        elapsed = await run_batch(operation, iterations)
+        if elapsed >= min_time or iterations >= 1_000_000:
+            break
+        iterations = min(1_000_000, max(iterations * 2, int(iterations * min_time / max(elapsed, 1e-9) * 1.2)))
+    per_op = [await run_batch(operation, iterations) / iterations for _ in range(rounds)]
+    median = statistics.median(per_op)
+    return {
+        "median": median,
+        "min": min(per_op),
+        "mean": statistics.fmean(per_op),
+        "stddev": statistics.stdev(per_op) if len(per_op) > 1 else 0.0,
+        "ops_per_sec": 1 / median if median else 0.0,
+        "iterations": iterations,
+        "rounds": rounds,
+    }
+
+
+class Suite:
+    """Fixtures and benchmark operations; `benchmarks()` lists what can run here."""
+
+    def __init__(self, args):
+        self.args = args
+        self.sizes = [int(size) for size in args.sizes.split(',') if size]
+        self.event_ids: List[uuid.UUID] = []
+        self.battle_ids: List[uuid.UUID] = []
+        self.has_db = False
+        self.has_redis = False
+        self.skipped: Dict[str, str] = {}
+
+    async def check_backends(self) -> None:
+        from sqlalchemy import text
+        from database import AsyncSessionLocal
+        from redis_client import redis_client
+
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(text("SELECT 1"))
+            self.has_db = True
+        except Exception as e:
+            print(f"Postgres unavailable, skipping database benchmarks: {e}", file=sys.stderr)
+        try:
+            await redis_client.redis.ping()
+            self.has_redis = True
+        except Exception as e:
+            print(f"Redis unavailable, skipping Redis benchmarks: {e}", file=sys.stderr)
+
+    async def create_battle(self, votes: int = 0):
+        """An open battle in a fresh event, with `votes` synthetic votes and its tallies."""
+        from sqlalchemy import text
+        from database import AsyncSessionLocal
+        from models import Battle, BattleStatus, Event
+        from votes import recount_tallies
+
+        now = datetime.now(timezone.utc)
+        async with AsyncSessionLocal() as db:
+            event = Event(name="hot path benchmark")
+            db.add(event)
+            await db.flush()
+            battle = Battle(
+                event_id=event.id, mc_a="A", mc_b="B", starts_at=now, ends_at=now + timedelta(hours=1),
+                status=BattleStatus.OPEN,
+            )
+            db.add(battle)
+            await db.flush()
+            self.event_ids.append(event.id)
+            self.battle_ids.append(battle.id)
+            if votes:
+                await db.execute(text("""
+                    INSERT INTO votes (battle_id, choice, device_hash)
+                    SELECT :battle_id, (ARRAY['A', 'B', 'A', 'B', 'REPLICA'])[1 + g % 5]::votechoice, 'bench-' || g
+                    FROM generate_series(1, :votes) g
+                """), {"battle_id": battle.id, "votes": votes})
+                await recount_tallies(db, [battle.id])
+            await db.commit()
+            return event.id, battle.id
+
+    async def cleanup(self) -> None:
+        if not self.battle_ids:
+            return
+        from sqlalchemy import text
+        from database import AsyncSessionLocal
+
+        async with AsyncSessionLocal() as db:
+            params = {"battles": self.battle_ids, "events": self.event_ids}
+            await db.execute(text("DELETE FROM votes WHERE battle_id = ANY(:battles)"), params)
+            await db.execute(text("DELETE FROM battle_tallies WHERE battle_id = ANY(:battles)"), params)
+            await db.execute(text("DELETE FROM battles WHERE id = ANY(:battles)"), params)
+            await db.execute(text("DELETE FROM events WHERE id = ANY(:events)"), params)
+            await db.commit()
+
+    # Benchmarks: each returns the operation to time, after any setup
+
+    async def bench_vote(self, concurrency: int = 1) -> Operation:
+        import httpx
+        from auth import create_event_token
+        from main import app
+        from redis_client import redis_client
+
+        event_id, battle_id = await self.create_battle()
+        await redis_client.set_rate_limit_overrides(str(event_id), {"ip": 0, "device": 0})
+        headers = {"Authorization": f"Bearer {create_event_token(str(event_id))}"}
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench")
+        self._clients.append(client)
+        counter = iter(range(10**9))
+
+        async def one_vote() -> None:
+            n = next(counter)
+            response = await client.post(
+                "/vote",
+                json={"battle_id": str(battle_id), "choice": "AB"[n % 2], "device_hash": f"bench-{n}"},
+                headers={**headers, "X-Forwarded-For": f"10.{(n >> 16) & 255}.{(n >> 8) & 255}.{n & 255}"},
+            )
+            if response.status_code != 200:
+                raise RuntimeError(f"vote failed: {response.status_code} {response.text}")
+
+        if concurrency == 1:
+            return one_vote
+
+        async def burst() -> None:
+            await asyncio.gather(*(one_vote() for _ in range(concurrency)))
+        return burst
+
+    async def bench_get_tallies_from_db(self, votes: int) -> Operation:
+        from database import AsyncSessionLocal
+        from tallies import get_tallies_from_db
+
+        _, battle_id = await self.create_battle(votes)
+        db = AsyncSessionLocal()
+        self._sessions.append(db)
+
+        async def read() -> None:
+            await get_tallies_from_db(str(battle_id), db)
+            await db.rollback()
+        return read
+
+    async def bench_recount_tallies(self, votes: int) -> Operation:
+        from database import AsyncSessionLocal
+        from votes import recount_tallies
+
+        _, battle_id = await self.create_battle(votes)
+        db = AsyncSessionLocal()
+        self._sessions.append(db)
+
+        async def recount() -> None:
+            await recount_tallies(db, [battle_id])
+            await db.rollback()
+        return recount
+
+    async def bench_verify_event_token(self, cached: bool) -> Operation:
+        from auth import create_event_token, token_cache, verify_event_token
+
+        token = create_event_token(str(uuid.uuid4()))
+
+        async def verify() -> None:
+            if not cached:
+                token_cache._entries.clear()
+            verify_event_token(token)
+        return verify
+
+    async def bench_check_rate_limit(self) -> Operation:
+        from redis_client import redis_client
+
+        event_id = str(uuid.uuid4())
+        await redis_client.set_rate_limit_overrides(event_id, {"ip": 10**9, "device": 10**9})
+        counter = iter(range(10**9))
+
+        async def check() -> None:
+            n = next(counter)
+            await redis_client.check_rate_limit(f"10.9.{(n >> 8) & 255}.{n & 255}", f"bench-{n % 1000}", event_id)
+        return check
+
+    async def bench_qr_render(self, cached: bool) -> Operation:
+        from qr import _render, battle_url, qr_renderer
+
+        url = battle_url(str(uuid.uuid4()))
+        if cached:
+            async def render() -> None:
+                await qr_renderer.render(url)
+        else:
+            async def render() -> None:
+                _render(url, 10)
+        return render
+
+    async def bench_sse_fanout(self, subscribers: int) -> Operation:
+        from hub import LatestQueue, PubSubHub
+
+        hub = PubSubHub()
+        channel = "battle:bench:tally"
+        queues = [LatestQueue() for _ in range(subscribers)]
+        hub._subscribers[channel] = set(queues)
+        message = '1792191894854-0 {"A": 1234, "B": 987, "REPLICA": 12, "version": 1792191894903}'
+
+        async def publish() -> None:
+            hub._dispatch(channel, message)
+            # Each stream picks up its update, as the SSE generators would
+            for queue in queues:
+                await queue.get()
+        return publish
+
+    def benchmarks(self) -> Dict[str, Callable[[], Awaitable[Operation]]]:
+        """Name -> factory for every benchmark, skipping those without a backend."""
+        available = {}
+
+        def add(name: str, factory, needs_db: bool = False, needs_redis: bool = False) -> None:
+            if needs_db and not self.has_db:
+                self.skipped[name] = "no database"
+            elif needs_redis and not self.has_redis:
+                self.skipped[name] = "no redis"
+            else:
+                available[name] = factory
+
+        add("vote", lambda: self.bench_vote(), needs_db=True, needs_redis=True)
+        add("vote_concurrent[50]", lambda: self.bench_vote(50), needs_db=True, needs_redis=True)
+        for size in self.sizes:
+            add(f"get_tallies_from_db[{size}]", lambda size=size: self.bench_get_tallies_from_db(size),
+                needs_db=True, needs_redis=True)
+        for size in self.sizes:
+            add(f"recount_tallies[{size}]", lambda size=size: self.bench_recount_tallies(size), needs_db=True)
+        add("verify_event_token[cached]", lambda: self.bench_verify_event_token(True))
+        add("verify_event_token[uncached]", lambda: self.bench_verify_event_token(False))
+        add("check_rate_limit", self.bench_check_rate_limit, needs_redis=True)
+        add("qr_render[cached]", lambda: self.bench_qr_render(True))
+        add("qr_render[uncached]", lambda: self.bench_qr_render(False))
+        for subscribers in (100, 1000, 10000):
+            add(f"sse_fanout[{subscribers}]", lambda n=subscribers: self.bench_sse_fanout(n))
+        return available
+
+    async def run(self) -> Dict[str, Dict[str, float]]:
+        from main import app
+
+        self._clients: list = []
+        self._sessions: list = []
+        await self.check_backends()
+        results = {}
+        # The lifespan starts the vote ingestor (group commit) that /vote relies on
+        async with app.router.lifespan_context(app):
+            try:
+                for name, factory in self.benchmarks().items():
+                    if self.args.keyword and not any(k in name for k in self.args.keyword):
+                        continue
+                    print(f"  {name} ...", end="", flush=True, file=sys.stderr)
+                    operation = await factory()
+                    results[name] = await measure(operation, self.args.min_time, self.args.rounds)
+                    print(f" {format_time(results[name]['median'])}", file=sys.stderr)
+            finally:
+                for client in self._clients:
+                    await client.aclose()
+                for db in self._sessions:
+                    await db.close()
+                await self.cleanup()
+        return results
+
+
+def format_time(seconds: float) -> str:
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
+
+
+def compare(results: Dict, baseline: Optional[Dict], threshold: float) -> List[str]:
+    """Print a results table against the baseline; return the regressed names."""
+    regressions = []
+    print(f"{'benchmark':34} {'median':>10} {'ops/s':>12} {'baseline':>10} {'change':>8}")
+    for name, stats in results.items():
+        line = f"{name:34} {format_time(stats['median']):>10} {stats['ops_per_sec']:>12,.0f}"
+        previous = (baseline or {}).get(name)
+        if previous:
+            change = stats["median"] / previous["median"] - 1
+            flag = ""
+            if change > threshold:
+                flag = "  REGRESSION"
+                regressions.append(name)
+            line += f" {format_time(previous['median']):>10} {change:>+8.1%}{flag}"
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-k', '--keyword', action='append', help='only run benchmarks whose name contains this')
+    parser.add_argument('--sizes', default='1000,100000,1000000', help='vote counts for the tally benchmarks')
+    parser.add_argument('--min-time', type=float, default=0.2, help='seconds per timed batch at least')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save', action='store_true', help='store these results as the baseline')
+    parser.add_argument('--threshold', type=float, default=0.2, help='median slowdown flagged as a regression')
+    parser.add_argument('--fake-redis', action='store_true', help='use an in-process Redis (fakeredis)')
+    parser.add_argument('-o', '--output', help='also write the results as JSON here')
+    args = parser.parse_args()
+
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    if args.fake_redis:
+        use_fake_redis()
+    sys.path.insert(0, API_DIR)
+
+    suite = Suite(args)
+    results = asyncio.run(suite.run())
+    for name, reason in suite.skipped.items():
+        print(f"skipped {name}: {reason}", file=sys.stderr)
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["benchmarks"]
+    regressions = compare(results, baseline, args.threshold)
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "benchmarks": results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        if baseline:
+            # Keep entries this run did not measure (e.g. with -k)
+            report["benchmarks"] = {**baseline, **results}
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    elif regressions:
+        print(f"{len(regressions)} benchmark(s) slower than baseline by more than {args.threshold:.0%}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
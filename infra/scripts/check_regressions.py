@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Regression checks against a running API.
+
+Each check provisions its own event and battle through the admin API, deletes
+them afterwards and prints PASS or FAIL; the script exits non-zero if any
+check fails. With no names given, every check runs.
+
+  stream-pool  live streams and long polls never hold a pooled DB connection:
+               with more of them open than the pool holds, votes still go
+               through instead of timing out
+  vote-ids     votes may spell the battle id as any valid UUID (canonical,
+               upper-case, without hyphens, in braces), even within one group
+               commit, and the tally counts every one
+  tally-sync   the Redis tally mirror never loses or double-counts a vote when
+               vote batches, cache misses and the reconciler write it in racy
+               orders; runs the API modules in-process, so DATABASE_URL must
+               name the server's database (REDIS_URL its Redis, or use
+               --fake-redis)
+
+    python infra/scripts/check_regressions.py --api http://localhost:8000
+    python infra/scripts/check_regressions.py vote-ids tally-sync --fake-redis
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+
+import aiohttp
+
+from provisioning import TestBattle, provisioned_battle
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../apps/api')
+
+
+async def open_stream(session: aiohttp.ClientSession, url: str, opened: list):
+    """Hold an SSE stream open, noting when its first event arrives."""
+    async with session.get(url) as r:
+        r.raise_for_status()
+        async for line in r.content:
+            if line.startswith(b"data:"):
+                opened.append(url)
+                break
+        # Keep reading until cancelled
+        async for _ in r.content:
+            pass
+
+
+async def long_poll(session: aiohttp.ClientSession, url: str):
+    """Park a long-poll request."""
+    async with session.get(url) as r:
+        await r.read()
+
+
+async def check_stream_pool(session: aiohttp.ClientSession, battle: TestBattle, args) -> bool:
+    streams = []
+    try:
+        opened: list = []
+        urls = [f"{args.api}/sse/battles/{battle.battle_id}"] * args.streams
+        urls += [f"{args.api}/sse/events/{battle.event_id}"] * max(1, args.streams // 10)
+        for url in urls:
+            streams.append(asyncio.create_task(open_stream(session, url, opened)))
+
+        deadline = time.monotonic() + args.timeout
+        while len(opened) < len(urls) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        print(f"Streams delivering: {len(opened)}/{len(urls)}")
+        if len(opened) < len(urls):
+            print("Not every stream received its initial snapshot")
+            return False
+
+        # Long polls park as well; they must not hold connections either
+        async with session.get(f"{args.api}/tallies/{battle.battle_id}") as r:
+            version = (await r.json()).get("version")
+        if version is not None:
+            for _ in range(max(1, args.streams // 10)):
+                url = f"{args.api}/tallies/{battle.battle_id}?since={version}"
+                streams.append(asyncio.create_task(long_poll(session, url)))
+
+        async def vote(i: int):
+            started = time.perf_counter()
+            async with session.post(
+                f"{args.api}/vote",
+                json={"battle_id": battle.battle_id, "choice": "AB"[i % 2], "device_hash": f"pool-check-{uuid.uuid4().hex}"},
+                headers={"Authorization": f"Bearer {battle.token}"},
+                timeout=aiohttp.ClientTimeout(total=args.timeout),
+            ) as r:
+                return r.status, time.perf_counter() - started
+
+        try:
+            results = await asyncio.gather(*[vote(i) for i in range(args.votes)])
+        except asyncio.TimeoutError:
+            print(f"Votes timed out after {args.timeout}s with {len(opened)} streams open")
+            return False
+        statuses = sorted({status for status, _ in results})
+        slowest = max(elapsed for _, elapsed in results)
+        print(f"Votes: {len(results)}, statuses {statuses}, slowest {slowest * 1000:.0f} ms")
+        return statuses == [200]
+    finally:
+        for task in streams:
+            task.cancel()
+        await asyncio.gather(*streams, return_exceptions=True)
+
+
+def spellings(battle_id: str) -> list:
+    """The same UUID written the ways clients might send it."""
+    parsed = uuid.UUID(battle_id)
+    return [str(parsed), str(parsed).upper(), parsed.hex, "{%s}" % parsed]
+
+
+async def check_vote_ids(session: aiohttp.ClientSession, battle: TestBattle, args) -> bool:
+    ids = spellings(battle.battle_id)
+
+    async def vote(i: int):
+        async with session.post(
+            f"{args.api}/vote",
+            json={"battle_id": ids[i % len(ids)], "choice": "AB"[i % 2], "device_hash": f"id-check-{i}"},
+            headers={"Authorization": f"Bearer {battle.token}"},
+        ) as r:
+            return ids[i % len(ids)], r.status, await r.text()
+
+    # One burst, so the spellings share group commits
+    results = await asyncio.gather(*[vote(i) for i in range(args.votes)])
+    failed = [(battle_id, status, body) for battle_id, status, body in results if status != 200]
+    for battle_id, status, body in failed[:5]:
+        print(f"{battle_id}: {status} {body}")
+    async with session.get(f"{args.api}/tallies/{battle.battle_id}") as r:
+        tally = await r.json()
+    counted = tally["A"] + tally["B"] + tally["REPLICA"]
+    print(f"Votes: {len(results)}, rejected {len(failed)}, tally {counted}")
+    return not failed and counted == len(results)
+
+
+async def commit_batch(battle_id: str, votes):
+    """Write (choice, device_hash) votes as one batch; returns its tally rows."""
+    from database import AsyncSessionLocal
+    from votes import VoteRow, read_tallies, upsert_votes
+
+    async with AsyncSessionLocal() as db:
+        await upsert_votes(db, [VoteRow(battle_id, choice, device) for choice, device in votes])
+        rows = await read_tallies(db, [battle_id])
+        await db.commit()
+    return rows
+
+
+async def check_tally_sync(session: aiohttp.ClientSession, battle: TestBattle, args) -> bool:
+    from database import AsyncSessionLocal
+    from redis_client import redis_client
+    from tallies import count_votes, get_live_tally, mirror_tallies, reconcile_tallies, record_tallies
+    from votes import read_tallies
+
+    battle_id = battle.battle_id
+
+    async def check(scenario: str) -> bool:
+        async with AsyncSessionLocal() as db:
+            expected = await count_votes(battle_id, db)
+        live = await redis_client.get_counts(battle_id)
+        live = {choice: count for choice, count in (live or {}).items() if choice in expected}
+        ok = live == expected
+        print(f"{scenario:12} {'ok' if ok else 'MISMATCH'}  postgres {expected}  redis {live}")
+        return ok
+
+    try:
+        async with AsyncSessionLocal() as db:
+            await get_live_tally(battle_id, db)
+        results = []
+
+        # A batch commits, the reconciler runs, then the batch's own update lands
+        rows = await commit_batch(battle_id, [("A", "dev-1"), ("B", "dev-2")])
+        await reconcile_tallies()
+        await record_tallies(rows)
+        results.append(await check("reconcile"))
+
+        # A cache miss reads the totals, a newer batch lands, then the miss writes
+        async with AsyncSessionLocal() as db:
+            stale = await read_tallies(db, [battle_id])
+        await record_tallies(await commit_batch(battle_id, [("A", "dev-3")]))
+        await mirror_tallies(stale)
+        results.append(await check("stale-seed"))
+
+        # Two batches for the same battle land in the opposite order
+        first = await commit_batch(battle_id, [("B", "dev-4")])
+        second = await commit_batch(battle_id, [("A", "dev-4"), ("REPLICA", "dev-5")])
+        await record_tallies(second)
+        await record_tallies(first)
+        results.append(await check("reordered"))
+        return all(results)
+    finally:
+        await redis_client.close()
+
+
+# name -> (check, provision_battle options)
+CHECKS = {
+    "stream-pool": (check_stream_pool, {"rate_limits": {"ip": 0}}),
+    "vote-ids": (check_vote_ids, {"rate_limits": {"ip": 0}}),
+    "tally-sync": (check_tally_sync, {}),
+}
+
+
+async def run(args) -> bool:
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=None)
+    results = {}
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        for name in args.checks:
+            check, options = CHECKS[name]
+            print(f"== {name}")
+            async with provisioned_battle(session, args.api, args.admin_key, f"{name} check", **options) as battle:
+                results[name] = await check(session, battle, args)
+            print("PASS" if results[name] else "FAIL")
+    if len(results) > 1:
+        print()
+        for name, ok in results.items():
+            print(f"{name:12} {'PASS' if ok else 'FAIL'}")
+    return all(results.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("checks", nargs="*", metavar="check", help=f"checks to run: {', '.join(CHECKS)} (default: all)")
+    parser.add_argument("--api", default="http://localhost:8000")
+    parser.add_argument("--admin-key", default="change-me")
+    parser.add_argument("--streams", type=int, default=40, help="stream-pool: should exceed DB_POOL_SIZE + DB_MAX_OVERFLOW")
+    parser.add_argument("--votes", type=int, default=40)
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--fake-redis", action="store_true", help="tally-sync: use an in-process Redis (fakeredis)")
+    args = parser.parse_args()
+    unknown = [name for name in args.checks if name not in CHECKS]
+    if unknown:
+        parser.error(f"unknown check: {', '.join(unknown)}")
+    args.checks = args.checks or list(CHECKS)
+
+    if "tally-sync" in args.checks:
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+        if args.fake_redis:
+            from bench_hot_paths import use_fake_redis
+            use_fake_redis()
+        sys.path.insert(0, API_DIR)
+    sys.exit(0 if asyncio.run(run(args)) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,6 @@ Creates sample events, battles, and generates QR codes
 
 import os
 import sys
-import uuid
 from datetime import datetime, timedelta
 import qrcode
 from io import BytesIO
@@ -16,18 +15,14 @@ import base64
 sys.path.append(os.path.join(os.path.dirname(__file__), '../../apps/api'))
 
 from database import get_db, engine
-from models import Event, Battle
+from models import Event, Battle, BattleStatus
 from sqlalchemy.orm import Session
-import secrets
 
 def create_demo_event(db: Session) -> Event:
     """Create a demo event"""
     event = Event(
-        id=str(uuid.uuid4()),
         name="Rap Battle Championship 2024",
-        description="The ultimate rap battle tournament featuring the best MCs from around the city",
         created_at=datetime.utcnow(),
-        signing_secret=secrets.token_urlsafe(32)
     )
     db.add(event)
     db.commit()
@@ -40,39 +35,36 @@ def create_demo_battles(db: Session, event_id: str) -> list[Battle]:
     
     # Battle 1: Current/Active
     battle1 = Battle(
-        id=str(uuid.uuid4()),
         event_id=event_id,
         mc_a="MC Thunder",
         mc_b="Rhyme Master",
         starts_at=datetime.utcnow() - timedelta(minutes=5),
         ends_at=datetime.utcnow() + timedelta(minutes=15),
-        status="open"
+        status=BattleStatus.OPEN
     )
     db.add(battle1)
     battles.append(battle1)
     
     # Battle 2: Upcoming
     battle2 = Battle(
-        id=str(uuid.uuid4()),
         event_id=event_id,
         mc_a="Word Wizard",
         mc_b="Flow King",
         starts_at=datetime.utcnow() + timedelta(minutes=20),
         ends_at=datetime.utcnow() + timedelta(minutes=40),
-        status="scheduled"
+        status=BattleStatus.SCHEDULED
     )
     db.add(battle2)
     battles.append(battle2)
     
     # Battle 3: Completed
     battle3 = Battle(
-        id=str(uuid.uuid4()),
         event_id=event_id,
         mc_a="Beat Breaker",
         mc_b="Verse Master",
         starts_at=datetime.utcnow() - timedelta(hours=1),
         ends_at=datetime.utcnow() - timedelta(minutes=40),
-        status="closed"
+        status=BattleStatus.CLOSED
     )
     db.add(battle3)
     battles.append(battle3)
@@ -123,7 +115,7 @@ def create_demo_data():
         battles = create_demo_battles(db, event.id)
         
         for battle in battles:
-            print(f"✅ Battle created: {battle.mc_a} vs {battle.mc_b} ({battle.status})")
+            print(f"✅ Battle created: {battle.mc_a} vs {battle.mc_b} ({battle.status.value})")
         
         # Generate QR codes and save them
         print("📱 Generating QR codes...")
@@ -134,7 +126,7 @@ def create_demo_data():
             qr_code = generate_qr_code(battle_url, battle.id)
             
             # Save QR code as HTML file
-            qr_file = f"demo_qr_{battle.id[:8]}.html"
+            qr_file = f"demo_qr_{str(battle.id)[:8]}.html"
             with open(qr_file, 'w') as f:
                 f.write(f"""
 <!DOCTYPE html>
@@ -153,7 +145,7 @@ def create_demo_data():
     <h1>🎤 RapBattle Voter</h1>
     <div class="battle-info">
         <h2>{battle.mc_a} vs {battle.mc_b}</h2>
-        <p><strong>Status:</strong> {battle.status.title()}</p>
+        <p><strong>Status:</strong> {battle.status.value.title()}</p>
         <p><strong>Starts:</strong> {battle.starts_at.strftime('%H:%M')}</p>
         <p><strong>Ends:</strong> {battle.ends_at.strftime('%H:%M')}</p>
     </div>
@@ -185,7 +177,7 @@ def create_demo_data():
         
         print(f"\n📱 QR Code Files:")
         for battle in battles:
-            print(f"  • demo_qr_{battle.id[:8]}.html")
+            print(f"  • demo_qr_{str(battle.id)[:8]}.html")
         
         print(f"\n🎯 To test the demo:")
         print(f"  1. Open http://localhost:3000/admin")
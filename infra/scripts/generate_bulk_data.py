@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Bulk synthetic data for benchmarking tallies and exports at scale.
+
+Streams events, battles, votes and their battle_tallies into Postgres with
+COPY, one transaction per event and several events at once. The crowd is modelled loosely on real nights:
+
+  - each event has one crowd of devices, and most of it votes in several battles
+  - battle sizes are heavy-tailed, and each battle has its own lean: mostly
+    close, sometimes a blowout, with a few percent REPLICA
+  - --change-rate of the devices change their vote, mostly towards the battle's
+    leader. The stored row holds the last choice and created_at the first vote
+    time, which is what the upsert on the vote path leaves behind
+  - IPs cluster: most of the crowd is behind a few venue Wi-Fi addresses, the
+    rest behind carrier NAT gateways (a few very busy ones, a long tail), and a
+    few votes have no IP
+  - vote times bunch up right after a battle opens
+
+The same --seed produces the same rows, ids included. Generated events are
+named "[synthetic] ..." and --purge deletes them with their battles and votes.
+
+    python infra/scripts/generate_bulk_data.py --votes 10000000 --events 25 --battles-per-event 20
+    python infra/scripts/generate_bulk_data.py --purge
+"""
+
+import argparse
+import base64
+import math
+import os
+import random
+import sys
+import time
+import uuid
+from bisect import bisect
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+from typing import Iterator, List, Optional, Tuple
+
+import psycopg
+from psycopg.copy import QueuedLibpqWriter
+from sqlalchemy.engine import make_url
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../apps/api'))
+
+from config import settings
+
+NAME_PREFIX = "[synthetic] "
+CHOICES = ("A", "B", "REPLICA")
+FIRST_EVENT_AT = datetime(2024, 1, 5, 20, 0, tzinfo=timezone.utc)
+BATTLE_SLOT = timedelta(minutes=15)
+BATTLE_LENGTH = timedelta(minutes=10)
+COPY_CHUNK_ROWS = 20_000
+MC_NAMES = (
+    "Thunder", "Rhyme Master", "Word Wizard", "Flow King", "Beat Breaker", "Verse Master", "Lyric Storm",
+    "Punchline", "Cipher", "Metaphor", "Freestyle Fury", "Bar Tender", "Echo", "Mic Check", "Cadence",
+)
+
+
+def conninfo(database_url: str) -> str:
+    """A libpq URL for psycopg from the API's (SQLAlchemy) database URL."""
+    return make_url(database_url).set(drivername="postgresql").render_as_string(hide_password=False)
+
+
+def seeded_uuid(rng: random.Random) -> uuid.UUID:
+    return uuid.UUID(int=rng.getrandbits(128), version=4)
+
+
+def device_hash(rng: random.Random) -> str:
+    """Shaped like the web client's hash: 32 base64 characters."""
+    return base64.b64encode(rng.getrandbits(192).to_bytes(24, "big")).decode()
+
+
+def split_votes(total: int, battles: int, rng: random.Random) -> List[int]:
+    """Heavy-tailed votes per battle adding up to `total`."""
+    weights = [rng.lognormvariate(0, 0.8) for _ in range(battles)]
+    scale = total / sum(weights)
+    sizes = [int(weight * scale) for weight in weights]
+    for i in range(total - sum(sizes)):
+        sizes[i % battles] += 1
+    return sizes
+
+
+class Crowd:
+    """An event's devices and the address each votes from."""
+
+    def __init__(self, size: int, rng: random.Random, venue_share: float):
+        venue_ips = [f"203.0.113.{rng.randrange(1, 255)}" for _ in range(rng.randint(2, 4))]
+        carrier_ips = [
+            f"{rng.choice((100, 172, 185, 31))}.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}"
+            for _ in range(max(1, size // 40))
+        ]
+        # Zipf-like: a few carrier gateways carry most of the mobile traffic
+        carrier_weights = list(accumulate(1 / (rank + 1) for rank in range(len(carrier_ips))))
+        self.hashes = [device_hash(rng) for _ in range(size)]
+        self.ips: List[Optional[str]] = []
+        for _ in range(size):
+            roll = rng.random()
+            if roll < 0.02:
+                self.ips.append(None)
+            elif roll < 0.02 + venue_share:
+                self.ips.append(rng.choice(venue_ips))
+            else:
+                self.ips.append(carrier_ips[bisect(carrier_weights, rng.random() * carrier_weights[-1])])
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def sample(self, count: int, rng: random.Random) -> Iterator[int]:
+        """`count` distinct devices, in a seeded order."""
+        size = len(self)
+        stride = rng.randrange(1, size) if size > 1 else 1
+        while math.gcd(stride, size) != 1:
+            stride += 1
+        start = rng.randrange(size)
+        return ((start + k * stride) % size for k in range(count))
+
+
+def battle_lean(rng: random.Random) -> Tuple[float, float]:
+    """(share of A among A/B votes, share of REPLICA) for one battle."""
+    if rng.random() < 0.15:
+        share_a = rng.choice((rng.uniform(0.08, 0.25), rng.uniform(0.75, 0.92)))
+    else:
+        share_a = rng.betavariate(12, 12)
+    return share_a, rng.uniform(0.01, 0.06)
+
+
+def vote_rows(battle_id: uuid.UUID, starts_at: datetime, votes: int, crowd: Crowd,
+              rng: random.Random, change_rate: float, tally: Counter) -> Iterator[str]:
+    """COPY text lines for a battle's votes, in vote time order."""
+    share_a, replica = battle_lean(rng)
+    leader = "A" if share_a >= 0.5 else "B"
+    cut_a = (1 - replica) * share_a
+    cut_b = 1 - replica
+    length = BATTLE_LENGTH.total_seconds()
+    # Beta(1, 3) by inversion: most votes land in the first minutes
+    offsets = sorted((1 - (1 - rng.random()) ** (1 / 3)) * length for _ in range(votes))
+    base = starts_at.timestamp()
+    battle = str(battle_id)
+
+    for device, offset in zip(crowd.sample(votes, rng), offsets):
+        roll = rng.random()
+        choice = "A" if roll < cut_a else "B" if roll < cut_b else "REPLICA"
+        if rng.random() < change_rate:
+            # Changers mostly move to the leader; the leader's own voters drift anywhere
+            if choice != leader and rng.random() < 0.75:
+                choice = leader
+            else:
+                choice = rng.choice([c for c in CHOICES if c != choice])
+        tally[choice] += 1
+        ip = crowd.ips[device] or "\\N"
+        created_at = datetime.fromtimestamp(base + offset, timezone.utc).isoformat()
+        yield f"{battle}\t{choice}\t{crowd.hashes[device]}\t{ip}\t{created_at}\n"
+
+
+def copy_lines(cursor: psycopg.Cursor, statement: str, lines: Iterator[str]) -> int:
+    """COPY text lines in chunks; returns the row count.
+
+    The queued writer sends chunks from a thread, so generating the next chunk
+    overlaps with Postgres ingesting the last one.
+    """
+    rows = 0
+    with cursor.copy(statement, writer=QueuedLibpqWriter(cursor)) as copy:
+        chunk = []
+        for line in lines:
+            chunk.append(line)
+            if len(chunk) == COPY_CHUNK_ROWS:
+                copy.write("".join(chunk))
+                rows += len(chunk)
+                chunk = []
+        if chunk:
+            copy.write("".join(chunk))
+            rows += len(chunk)
+    return rows
+
+
+def load_event(database_url: str, index: int, battle_sizes: List[int], args) -> int:
+    """Generate and COPY one event with its battles, votes and tallies (run in a worker)."""
+    rng = random.Random(f"{args.seed}:{index}")
+    event_id = seeded_uuid(rng)
+    event_at = FIRST_EVENT_AT + timedelta(days=7 * index)
+    crowd = Crowd(max(2, int(max(battle_sizes) * 1.3)), rng, args.venue_share)
+
+    battles = []
+    for slot in range(len(battle_sizes)):
+        mc_a, mc_b = rng.sample(MC_NAMES, 2)
+        starts_at = event_at + slot * BATTLE_SLOT
+        battles.append((seeded_uuid(rng), mc_a, mc_b, starts_at))
+
+    rows = 0
+    with psycopg.connect(database_url) as conn, conn.cursor() as cursor:
+        cursor.execute("SET synchronous_commit = off")
+        cursor.execute(
+            "INSERT INTO events (id, name, created_at, updated_at) VALUES (%s, %s, %s, %s)",
+            (event_id, f"{NAME_PREFIX}Night {index + 1}", event_at - timedelta(days=14), event_at),
+        )
+        with cursor.copy("COPY battles (id, event_id, mc_a, mc_b, starts_at, ends_at, status, created_at, updated_at)"
+                         " FROM STDIN") as copy:
+            for battle_id, mc_a, mc_b, starts_at in battles:
+                ends_at = starts_at + BATTLE_LENGTH
+                copy.write_row((battle_id, event_id, mc_a, mc_b, starts_at, ends_at, "CLOSED",
+                                event_at - timedelta(days=7), ends_at))
+
+        tallies = []
+        for (battle_id, _, _, starts_at), votes in zip(battles, battle_sizes):
+            tally = Counter()
+            rows += copy_lines(
+                cursor,
+                "COPY votes (battle_id, choice, device_hash, ip_address, created_at) FROM STDIN",
+                vote_rows(battle_id, starts_at, votes, crowd, rng, args.change_rate, tally),
+            )
+            tallies.extend((battle_id, choice, tally[choice]) for choice in CHOICES)
+
+        with cursor.copy("COPY battle_tallies (battle_id, choice, count) FROM STDIN") as copy:
+            for row in tallies:
+                copy.write_row(row)
+    return rows
+
+
+def purge(conn: psycopg.Connection) -> None:
+    """Delete every generated event with its battles, votes and tallies."""
+    with conn.transaction(), conn.cursor() as cursor:
+        cursor.execute("SELECT id FROM events WHERE name LIKE %s", (NAME_PREFIX.replace("[", "\\[") + "%",))
+        events = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT id FROM battles WHERE event_id = ANY(%s)", (events,))
+        battles = [row[0] for row in cursor.fetchall()]
+        cursor.execute("DELETE FROM votes WHERE battle_id = ANY(%s)", (battles,))
+        votes = cursor.rowcount
+        cursor.execute("DELETE FROM battle_tallies WHERE battle_id = ANY(%s)", (battles,))
+        cursor.execute("DELETE FROM battles WHERE id = ANY(%s)", (battles,))
+        cursor.execute("DELETE FROM events WHERE id = ANY(%s)", (events,))
+    print(f"Purged {len(events)} events, {len(battles)} battles, {votes} votes")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default=settings.database_url)
+    parser.add_argument('--votes', type=int, default=1_000_000, help='total votes across all battles')
+    parser.add_argument('--events', type=int, default=10)
+    parser.add_argument('--battles-per-event', type=int, default=20)
+    parser.add_argument('--change-rate', type=float, default=0.08, help='share of devices that change their vote')
+    parser.add_argument('--venue-share', type=float, default=0.6, help='share of devices on venue Wi-Fi')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--jobs', type=int, default=min(4, os.cpu_count() or 1), help='events loaded at once')
+    parser.add_argument('--purge', action='store_true', help='delete generated data instead')
+    args = parser.parse_args()
+
+    with psycopg.connect(conninfo(args.database_url)) as conn:
+        if args.purge:
+            purge(conn)
+            return
+
+        rng = random.Random(args.seed)
+        sizes = split_votes(args.votes, args.events * args.battles_per_event, rng)
+        started = time.perf_counter()
+        total = 0
+        # Events are independent (own seed, own transaction), so they load in parallel
+        with ProcessPoolExecutor(args.jobs) as pool:
+            loads = [
+                pool.submit(load_event, conninfo(args.database_url), index,
+                            sizes[index * args.battles_per_event:(index + 1) * args.battles_per_event], args)
+                for index in range(args.events)
+            ]
+            for done, load in enumerate(as_completed(loads), 1):
+                total += load.result()
+                elapsed = time.perf_counter() - started
+                print(f"event {done}/{args.events}: {total:,} votes, {total / elapsed:,.0f} rows/s", file=sys.stderr)
+
+        conn.execute("ANALYZE votes")
+        conn.execute("ANALYZE battle_tallies")
+        conn.commit()
+        elapsed = time.perf_counter() - started
+        print(f"Loaded {args.events} events, {len(sizes)} battles and {total:,} votes in {elapsed:.0f}s")
+
+
+if __name__ == '__main__':
+    main()
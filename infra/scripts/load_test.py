@@ -1,199 +1,263 @@
 #!/usr/bin/env python3
 """
 Load testing script for the RapBattle Voter API.
-Tests concurrent voting and system performance.
+Drives the vote write path with realistic crowd shapes and reports latency
+percentiles, errors by status and throughput over time as JSON.
+
+Scenarios:
+  storm  opening bell: every device votes once, all at the same moment
+  churn  devices vote, then keep changing their vote with think time in between
+  nat    a crowd behind a few shared IPs (venue Wi-Fi), all voting at once
+
+Each run provisions its own event, open battle and token through the admin API
+and deletes them afterwards (unless --keep). All simulated devices share one
+connection pool of --connections sockets.
+
+    python infra/scripts/load_test.py --scenario storm --devices 5000 --connections 200
+    python infra/scripts/load_test.py --scenario nat --devices 2000 --nat-ips 3 --ip-limit 0 -o nat.json
 """
 
+import argparse
 import asyncio
-import aiohttp
-import time
-import uuid
+import json
+import math
 import random
-from typing import List, Dict, Any
+import sys
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Dict, List
+
+import aiohttp
+
+from provisioning import delete_event, provision_battle
+
+SCENARIOS = ("storm", "churn", "nat")
+PERCENTILES = (50, 95, 99, 99.9)
+
+
+@dataclass
+class Device:
+    """A simulated phone: who it is, where it votes from and what it votes."""
+    device_hash: str
+    ip: str
+    choices: List[str]
+    start_delay: float = 0.0
+
+
+@dataclass
+class Sample:
+    """One vote request: when it was sent (s since start), its latency and outcome."""
+    sent_at: float
+    latency: float
+    outcome: str
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of already sorted values."""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(pct / 100 * len(sorted_values)) - 1
+    return sorted_values[max(0, min(len(sorted_values) - 1, rank))]
+
+
+def device_ip(index: int) -> str:
+    """A distinct private IPv4 address per index."""
+    return f"10.{(index >> 16) & 255}.{(index >> 8) & 255}.{index & 255}"
+
+
+def pick_choice(rng: random.Random, skew: float) -> str:
+    """A or B, with `skew` the share of A."""
+    return "A" if rng.random() < skew else "B"
+
+
+def build_devices(args, rng: random.Random) -> List[Device]:
+    """The crowd for a scenario."""
+    devices = []
+    for i in range(args.devices):
+        device_hash = f"load-{args.scenario}-{args.seed}-{i}"
+        start_delay = i / args.rate if args.rate else 0.0
+        if args.scenario == "storm":
+            devices.append(Device(device_hash, device_ip(i), [pick_choice(rng, args.skew)], start_delay))
+        elif args.scenario == "churn":
+            first = pick_choice(rng, args.skew)
+            choices = [first]
+            for _ in range(args.changes):
+                choices.append("B" if choices[-1] == "A" else "A")
+            devices.append(Device(device_hash, device_ip(i), choices, start_delay))
+        else:
+            ip = device_ip(i % args.nat_ips)
+            devices.append(Device(device_hash, ip, [pick_choice(rng, args.skew)], start_delay))
+    return devices
 
-# Configuration
-API_BASE = "http://localhost:8000"
-CONCURRENT_USERS = 50
-VOTES_PER_USER = 3
-BATTLE_ID = "your-battle-id-here"  # Replace with actual battle ID
-EVENT_TOKEN = "your-event-token-here"  # Replace with actual token
 
 class LoadTester:
-    def __init__(self, api_base: str, battle_id: str, event_token: str):
-        self.api_base = api_base
+    """Sends the crowd's votes over one shared session and records every request."""
+
+    def __init__(self, session: aiohttp.ClientSession, api: str, battle_id: str, token: str,
+                 concurrency: int, think_time: float, rng: random.Random):
+        self.session = session
+        self.api = api
         self.battle_id = battle_id
-        self.event_token = event_token
-        self.results = []
-        self.errors = []
-    
-    async def simulate_user(self, user_id: int) -> Dict[str, Any]:
-        """Simulate a single user voting multiple times."""
-        user_results = {
-            "user_id": user_id,
-            "votes": [],
-            "errors": [],
-            "start_time": time.time(),
-            "end_time": None,
-        }
-        
-        # Generate unique device hash for this user
-        device_hash = f"load_test_user_{user_id}_{uuid.uuid4().hex[:8]}"
-        
-        async with aiohttp.ClientSession() as session:
-            for vote_num in range(VOTES_PER_USER):
-                try:
-                    # Simulate some thinking time
-                    await asyncio.sleep(random.uniform(0.1, 0.5))
-                    
-                    # Make vote request
-                    vote_choice = random.choice(["A", "B"])
-                    start_time = time.time()
-                    
-                    async with session.post(
-                        f"{self.api_base}/vote",
-                        headers={
-                            "Authorization": f"Bearer {self.event_token}",
-                            "Content-Type": "application/json",
-                        },
-                        json={
-                            "battle_id": self.battle_id,
-                            "choice": vote_choice,
-                            "device_hash": f"{device_hash}_{vote_num}",
-                        }
-                    ) as response:
-                        end_time = time.time()
-                        response_time = end_time - start_time
-                        
-                        if response.status == 200:
-                            result = await response.json()
-                            user_results["votes"].append({
-                                "vote_num": vote_num,
-                                "choice": vote_choice,
-                                "response_time": response_time,
-                                "success": result.get("success", False),
-                                "tally": result.get("tally"),
-                            })
-                        else:
-                            error_text = await response.text()
-                            user_results["errors"].append({
-                                "vote_num": vote_num,
-                                "status": response.status,
-                                "error": error_text,
-                            })
-                
-                except Exception as e:
-                    user_results["errors"].append({
-                        "vote_num": vote_num,
-                        "error": str(e),
-                    })
-        
-        user_results["end_time"] = time.time()
-        user_results["total_time"] = user_results["end_time"] - user_results["start_time"]
-        
-        return user_results
-    
-    async def run_load_test(self, concurrent_users: int):
-        """Run the load test with specified number of concurrent users."""
-        print(f"Starting load test with {concurrent_users} concurrent users...")
-        print(f"Each user will attempt {VOTES_PER_USER} votes")
-        print(f"Total expected requests: {concurrent_users * VOTES_PER_USER}")
-        print("-" * 50)
-        
-        start_time = time.time()
-        
-        # Create tasks for all users
-        tasks = [
-            self.simulate_user(user_id) 
-            for user_id in range(concurrent_users)
-        ]
-        
-        # Run all users concurrently
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        
-        end_time = time.time()
-        total_time = end_time - start_time
-        
-        # Process results
-        successful_users = []
-        failed_users = []
-        
-        for i, result in enumerate(results):
-            if isinstance(result, Exception):
-                failed_users.append({"user_id": i, "error": str(result)})
-            else:
-                successful_users.append(result)
-        
-        # Print summary
-        print(f"\nLoad Test Complete!")
-        print(f"Total time: {total_time:.2f} seconds")
-        print(f"Successful users: {len(successful_users)}")
-        print(f"Failed users: {len(failed_users)}")
-        
-        # Calculate statistics
-        if successful_users:
-            total_votes = sum(len(user["votes"]) for user in successful_users)
-            total_errors = sum(len(user["errors"]) for user in successful_users)
-            
-            response_times = []
-            for user in successful_users:
-                response_times.extend([vote["response_time"] for vote in user["votes"]])
-            
-            if response_times:
-                avg_response_time = sum(response_times) / len(response_times)
-                min_response_time = min(response_times)
-                max_response_time = max(response_times)
-                
-                print(f"\nVote Statistics:")
-                print(f"Total successful votes: {total_votes}")
-                print(f"Total errors: {total_errors}")
-                print(f"Average response time: {avg_response_time:.3f}s")
-                print(f"Min response time: {min_response_time:.3f}s")
-                print(f"Max response time: {max_response_time:.3f}s")
-                
-                # Requests per second
-                rps = total_votes / total_time
-                print(f"Requests per second: {rps:.2f}")
-        
-        # Show errors
-        if failed_users:
-            print(f"\nFailed Users:")
-            for failed in failed_users:
-                print(f"User {failed['user_id']}: {failed['error']}")
-        
-        # Show some successful vote details
-        if successful_users:
-            print(f"\nSample Successful Votes:")
-            for user in successful_users[:3]:  # Show first 3 users
-                print(f"User {user['user_id']}: {len(user['votes'])} votes, {len(user['errors'])} errors")
-                for vote in user["votes"][:2]:  # Show first 2 votes per user
-                    print(f"  Vote {vote['vote_num']}: {vote['choice']} ({vote['response_time']:.3f}s)")
-
-async def main():
-    """Main function to run the load test."""
-    print("RapBattle Voter Load Test")
-    print("=" * 50)
-    
-    # Check if battle ID and token are provided
-    if BATTLE_ID == "your-battle-id-here" or EVENT_TOKEN == "your-event-token-here":
-        print("Please update BATTLE_ID and EVENT_TOKEN in the script before running.")
-        print("You can get these by running create_sample_data.py")
-        return
-    
-    # Test API connectivity
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"{API_BASE}/healthz") as response:
-                if response.status != 200:
-                    print(f"API health check failed: {response.status}")
-                    return
-                print("API health check passed")
-    except Exception as e:
-        print(f"Failed to connect to API: {e}")
-        return
-    
-    # Run load test
-    tester = LoadTester(API_BASE, BATTLE_ID, EVENT_TOKEN)
-    await tester.run_load_test(CONCURRENT_USERS)
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.slots = asyncio.Semaphore(concurrency)
+        self.think_time = think_time
+        self.rng = rng
+        self.samples: List[Sample] = []
+        self.started = 0.0
+
+    async def vote(self, device: Device, choice: str) -> None:
+        """Send one vote and record how it went."""
+        async with self.slots:
+            sent = time.perf_counter()
+            try:
+                async with self.session.post(
+                    f"{self.api}/vote",
+                    json={"battle_id": self.battle_id, "choice": choice, "device_hash": device.device_hash},
+                    headers={**self.headers, "X-Forwarded-For": device.ip},
+                ) as response:
+                    await response.read()
+                    outcome = str(response.status)
+            except Exception as e:
+                outcome = f"exception:{type(e).__name__}"
+            done = time.perf_counter()
+        self.samples.append(Sample(sent - self.started, done - sent, outcome))
+
+    async def simulate_device(self, device: Device) -> None:
+        """Cast the device's votes in order, thinking between changes."""
+        if device.start_delay:
+            await asyncio.sleep(device.start_delay)
+        for n, choice in enumerate(device.choices):
+            if n and self.think_time:
+                await asyncio.sleep(self.rng.uniform(0.5, 1.5) * self.think_time)
+            await self.vote(device, choice)
+
+    async def run(self, devices: List[Device]) -> float:
+        """Release every device at once (the bell); returns the wall time taken."""
+        self.started = time.perf_counter()
+        await asyncio.gather(*(self.simulate_device(device) for device in devices))
+        return time.perf_counter() - self.started
+
+
+def summarize(samples: List[Sample], elapsed: float, interval: float) -> Dict:
+    """Latency percentiles, outcome counts and per-interval throughput."""
+    ok_latencies = sorted(sample.latency for sample in samples if sample.outcome == "200")
+    all_latencies = sorted(sample.latency for sample in samples)
+
+    def latency_stats(values: List[float]) -> Dict[str, float]:
+        if not values:
+            return {}
+        stats = {f"p{pct:g}".replace(".", ""): round(percentile(values, pct) * 1000, 2) for pct in PERCENTILES}
+        stats.update(
+            min=round(values[0] * 1000, 2),
+            mean=round(sum(values) / len(values) * 1000, 2),
+            max=round(values[-1] * 1000, 2),
+        )
+        return stats
+
+    timeline = defaultdict(lambda: {"requests": 0, "ok": 0, "errors": 0})
+    for sample in samples:
+        bucket = timeline[int((sample.sent_at + sample.latency) // interval)]
+        bucket["requests"] += 1
+        bucket["ok" if sample.outcome == "200" else "errors"] += 1
+
+    return {
+        "requests": len(samples),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(samples) / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": latency_stats(ok_latencies),
+        "latency_all_ms": latency_stats(all_latencies),
+        "outcomes": dict(Counter(sample.outcome for sample in samples).most_common()),
+        "timeline": [
+            {"t": round(index * interval, 3), **timeline[index],
+             "rps": round(timeline[index]["requests"] / interval, 1)}
+            for index in sorted(timeline)
+        ],
+    }
+
+
+async def main_async(args) -> Dict:
+    rng = random.Random(args.seed)
+    rate_limits = {}
+    if args.ip_limit is not None:
+        rate_limits["ip"] = args.ip_limit
+    if args.device_limit is not None:
+        rate_limits["device"] = args.device_limit
+
+    connector = aiohttp.TCPConnector(limit=args.connections)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        async with session.get(f"{args.api}/healthz") as response:
+            if response.status != 200:
+                sys.exit(f"API health check failed: {response.status}")
+
+        battle = await provision_battle(
+            session, args.api, args.admin_key, f"load test ({args.scenario})", rate_limits=rate_limits or None
+        )
+        try:
+            devices = build_devices(args, rng)
+            votes = sum(len(device.choices) for device in devices)
+            print(f"{args.scenario}: {len(devices)} devices, {votes} votes, "
+                  f"{args.connections} connections, battle {battle.battle_id}", file=sys.stderr)
+            tester = LoadTester(
+                session, args.api, battle.battle_id, battle.token,
+                concurrency=args.connections, think_time=args.think_time, rng=rng,
+            )
+            elapsed = await tester.run(devices)
+            async with session.get(f"{args.api}/tallies/{battle.battle_id}") as response:
+                tally = await response.json()
+        finally:
+            if not args.keep:
+                await delete_event(session, args.api, args.admin_key, battle.event_id)
+
+    return {
+        "scenario": args.scenario,
+        "config": {
+            "api": args.api, "devices": args.devices, "connections": args.connections,
+            "rate": args.rate, "changes": args.changes if args.scenario == "churn" else 0,
+            "think_time": args.think_time if args.scenario == "churn" else 0,
+            "nat_ips": args.nat_ips if args.scenario == "nat" else None,
+            "rate_limits": rate_limits, "seed": args.seed,
+        },
+        "battle_id": battle.battle_id,
+        "final_tally": tally,
+        **summarize(tester.samples, elapsed, args.interval),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--api", default="http://localhost:8000")
+    parser.add_argument("--admin-key", default="change-me")
+    parser.add_argument("--scenario", choices=SCENARIOS, default="storm")
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--connections", type=int, default=100, help="shared pool size = votes in flight")
+    parser.add_argument("--rate", type=float, default=0.0, help="devices starting per second (0: all at the bell)")
+    parser.add_argument("--changes", type=int, default=4, help="churn: vote changes per device")
+    parser.add_argument("--think-time", type=float, default=1.0, help="churn: mean seconds between changes")
+    parser.add_argument("--nat-ips", type=int, default=1, help="nat: shared public IPs")
+    parser.add_argument("--skew", type=float, default=0.55, help="share of votes for A")
+    parser.add_argument("--ip-limit", type=int, help="per-event IP rate limit override for the run (0 disables)")
+    parser.add_argument("--device-limit", type=int, help="per-event device rate limit override for the run")
+    parser.add_argument("--interval", type=float, default=1.0, help="throughput timeline bucket (s)")
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-request timeout (s)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--keep", action="store_true", help="leave the provisioned event in place")
+    parser.add_argument("-o", "--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    report = asyncio.run(main_async(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+        latency = report["latency_ms"]
+        print(f"{report['requests']} requests in {report['elapsed_s']}s ({report['throughput_rps']} rps), "
+              f"p50 {latency.get('p50')} ms, p99 {latency.get('p99')} ms, outcomes {report['outcomes']}",
+              file=sys.stderr)
+    else:
+        print(text)
+
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    main()
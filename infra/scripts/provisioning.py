@@ -0,0 +1,70 @@
+"""Throwaway events for the load and regression scripts, created through the admin API."""
+
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Dict, Optional
+
+import aiohttp
+
+
+@dataclass
+class TestBattle:
+    """An event with one battle and a voting token."""
+    event_id: str
+    battle_id: str
+    token: str
+
+
+async def provision_battle(
+    session: aiohttp.ClientSession,
+    api: str,
+    admin_key: str,
+    name: str,
+    open_battle: bool = True,
+    rate_limits: Optional[Dict[str, int]] = None,
+) -> TestBattle:
+    """Create an event with one battle (opened unless told otherwise) and a token."""
+    headers = {"X-Admin-Key": admin_key}
+    async with session.post(f"{api}/admin/events", json={"name": name}, headers=headers) as r:
+        r.raise_for_status()
+        event_id = (await r.json())["id"]
+    now = datetime.now(timezone.utc)
+    battle = {
+        "event_id": event_id,
+        "mc_a": "MC A",
+        "mc_b": "MC B",
+        "starts_at": now.isoformat(),
+        "ends_at": (now + timedelta(hours=1)).isoformat(),
+    }
+    async with session.post(f"{api}/admin/battles", json=battle, headers=headers) as r:
+        r.raise_for_status()
+        battle_id = (await r.json())["id"]
+    if open_battle:
+        async with session.post(f"{api}/admin/battles/{battle_id}/open", json={}, headers=headers) as r:
+            r.raise_for_status()
+    if rate_limits:
+        async with session.put(f"{api}/admin/events/{event_id}/rate-limits", json=rate_limits, headers=headers) as r:
+            r.raise_for_status()
+    async with session.post(f"{api}/admin/events/{event_id}/token", headers=headers) as r:
+        r.raise_for_status()
+        token = (await r.json())["token"]
+    return TestBattle(event_id=event_id, battle_id=battle_id, token=token)
+
+
+async def delete_event(session: aiohttp.ClientSession, api: str, admin_key: str, event_id: str) -> None:
+    """Delete a provisioned event; the API removes its battles, votes and tallies with it."""
+    async with session.delete(f"{api}/admin/events/{event_id}", headers={"X-Admin-Key": admin_key}):
+        pass
+
+
+@asynccontextmanager
+async def provisioned_battle(
+    session: aiohttp.ClientSession, api: str, admin_key: str, name: str, **options
+) -> AsyncIterator[TestBattle]:
+    """`provision_battle` for the length of a block; the event is deleted afterwards."""
+    battle = await provision_battle(session, api, admin_key, name, **options)
+    try:
+        yield battle
+    finally:
+        await delete_event(session, api, admin_key, battle.event_id)
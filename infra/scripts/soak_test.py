@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+"""
+Fan-out soak test: many live viewers on one battle while votes keep coming.
+
+Opens --sse EventSource-style clients on /sse/battles/{id} and/or --pollers
+clients polling /tallies/{id} every --poll-interval seconds (with If-None-Match,
+as browsers do), ramped up over --ramp seconds and spread over --processes
+client processes. Meanwhile votes are cast at --vote-rate per second.
+
+Reports as JSON:
+  - vote-to-screen delivery latency percentiles for SSE and for polling: from
+    sending the vote that produced a tally version to a client receiving it
+  - streams that failed to open or dropped mid-soak, by reason
+  - server resident memory and open file descriptors over time, from /metrics
+    (the worker that answers) and, with --server-pid, from /proc on this host
+
+Tens of thousands of clients need a high open-file limit (raised to the hard
+limit automatically) and, against one server address, several --processes
+and enough ephemeral ports.
+
+    python infra/scripts/soak_test.py --sse 20000 --processes 8 --vote-rate 20 --duration 300 --server-pid 1234
+    python infra/scripts/soak_test.py --pollers 5000 --poll-interval 2 --duration 120
+"""
+
+import argparse
+import asyncio
+import functools
+import json
+import math
+import multiprocessing
+import os
+import random
+import re
+import resource
+import sys
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+
+from provisioning import delete_event, provision_battle
+
+PERCENTILES = (50, 90, 95, 99, 99.9)
+METRIC_LINE = re.compile(r"^(process_resident_memory_bytes|process_open_fds|sse_streams|stream_buffered_bytes) (\S+)$", re.M)
+
+
+def raise_fd_limit() -> int:
+    """Lift the soft open-file limit to the hard limit; returns the new soft limit."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """Nearest-rank percentiles (ms) of latencies in seconds."""
+    if not values:
+        return {}
+    values = sorted(values)
+    stats = {}
+    for pct in PERCENTILES:
+        rank = max(0, min(len(values) - 1, math.ceil(pct / 100 * len(values)) - 1))
+        stats[f"p{pct:g}".replace(".", "")] = round(values[rank] * 1000, 1)
+    stats["max"] = round(values[-1] * 1000, 1)
+    return stats
+
+
+class Reservoir:
+    """Fixed-size uniform sample of a stream of items."""
+
+    def __init__(self, size: int, rng: random.Random):
+        self.size = size
+        self.rng = rng
+        self.seen = 0
+        self.items: list = []
+
+    def add(self, item) -> None:
+        self.seen += 1
+        if len(self.items) < self.size:
+            self.items.append(item)
+        else:
+            slot = self.rng.randrange(self.seen)
+            if slot < self.size:
+                self.items[slot] = item
+
+
+class Viewers:
+    """The SSE clients and pollers of one client process."""
+
+    def __init__(self, args, battle_id: str, worker: int):
+        self.args = args
+        self.battle_id = battle_id
+        rng = random.Random(args.seed * 1000 + worker)
+        # (tally version, wall clock at receipt)
+        self.sse_deliveries = Reservoir(args.reservoir, rng)
+        self.poll_deliveries = Reservoir(args.reservoir, rng)
+        self.poll_durations = Reservoir(args.reservoir, rng)
+        self.opened = 0
+        self.open_failures: Counter = Counter()
+        self.drops: Counter = Counter()
+        self.heartbeats = 0
+        self.messages = 0
+        self.poll_statuses: Counter = Counter()
+        self.stopping = False
+
+    async def sse_client(self, session: aiohttp.ClientSession) -> None:
+        """Follow the battle's stream like EventSource, reconnecting with Last-Event-ID."""
+        url = f"{self.args.api}/sse/battles/{self.battle_id}"
+        last_id = None
+        connected_once = False
+        while not self.stopping:
+            headers = {"Last-Event-ID": last_id} if last_id else {}
+            try:
+                async with session.get(url, headers=headers) as response:
+                    if response.status != 200:
+                        target = self.drops if connected_once else self.open_failures
+                        target[f"status:{response.status}"] += 1
+                    else:
+                        if not connected_once:
+                            self.opened += 1
+                            connected_once = True
+                        # The first event of a fresh stream is a snapshot, not a delivery
+                        skip_next = last_id is None
+                        async for line in response.content:
+                            if line.startswith(b"data:"):
+                                self.messages += 1
+                                received = time.time()
+                                if skip_next:
+                                    skip_next = False
+                                    continue
+                                version = json.loads(line[5:]).get("version")
+                                if version is not None:
+                                    self.sse_deliveries.add((version, received))
+                            elif line.startswith(b"id:"):
+                                last_id = line[3:].strip().decode()
+                            elif line.startswith(b":heartbeat"):
+                                self.heartbeats += 1
+                        if not self.stopping:
+                            self.drops["closed by server"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if self.stopping:
+                    return
+                target = self.drops if connected_once else self.open_failures
+                target[type(e).__name__] += 1
+            if not self.args.reconnect:
+                return
+            await asyncio.sleep(self.args.retry)
+
+    async def poller(self, session: aiohttp.ClientSession) -> None:
+        """Poll the tally every interval, revalidating with the last ETag."""
+        url = f"{self.args.api}/tallies/{self.battle_id}"
+        etag = None
+        version = None
+        # Spread pollers over the interval like phones loading at different times
+        await asyncio.sleep(random.uniform(0, self.args.poll_interval))
+        while not self.stopping:
+            started = time.perf_counter()
+            try:
+                async with session.get(url, headers={"If-None-Match": etag} if etag else {}) as response:
+                    self.poll_statuses[str(response.status)] += 1
+                    if response.status == 200:
+                        tally = await response.json()
+                        etag = response.headers.get("ETag")
+                        if version is not None and tally.get("version") != version:
+                            self.poll_deliveries.add((tally.get("version"), time.time()))
+                        version = tally.get("version")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.poll_statuses[type(e).__name__] += 1
+            self.poll_durations.add(time.perf_counter() - started)
+            await asyncio.sleep(self.args.poll_interval)
+
+    async def run(self, n_sse: int, n_pollers: int) -> Dict:
+        raise_fd_limit()
+        connector = aiohttp.TCPConnector(limit=0, force_close=False)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=None)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            tasks = []
+            total = n_sse + n_pollers
+            for i in range(total):
+                client = self.sse_client(session) if i < n_sse else self.poller(session)
+                tasks.append(asyncio.create_task(client))
+                if self.args.ramp and total:
+                    await asyncio.sleep(self.args.ramp / total)
+            await asyncio.sleep(max(0.0, self.args.deadline - time.time()))
+            self.stopping = True
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return {
+            "sse_deliveries": self.sse_deliveries.items,
+            "sse_deliveries_seen": self.sse_deliveries.seen,
+            "poll_deliveries": self.poll_deliveries.items,
+            "poll_durations": self.poll_durations.items,
+            "opened": self.opened,
+            "open_failures": dict(self.open_failures),
+            "drops": dict(self.drops),
+            "heartbeats": self.heartbeats,
+            "messages": self.messages,
+            "poll_statuses": dict(self.poll_statuses),
+        }
+
+
+def client_process(args, battle_id: str, worker: int, n_sse: int, n_pollers: int, results) -> None:
+    results.put(asyncio.run(Viewers(args, battle_id, worker).run(n_sse, n_pollers)))
+
+
+def split(total: int, parts: int) -> List[int]:
+    return [total // parts + (1 if i < total % parts else 0) for i in range(parts)]
+
+
+def read_proc(pids: List[int]) -> Tuple[int, int]:
+    """Resident bytes and open fds of `pids` and their children, from /proc."""
+    wanted = set(pids)
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    parent = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            if parent in pids:
+                wanted.add(int(entry))
+    rss = fds = 0
+    page = os.sysconf("SC_PAGE_SIZE")
+    for pid in wanted:
+        try:
+            with open(f"/proc/{pid}/statm") as f:
+                rss += int(f.read().split()[1]) * page
+            fds += len(os.listdir(f"/proc/{pid}/fd"))
+        except OSError:
+            continue
+    return rss, fds
+
+
+async def sample_server(session: aiohttp.ClientSession, args, started: float, timeline: list) -> None:
+    """Record server memory, fds and stream counts every --sample-interval."""
+    while True:
+        sample = {"t": round(time.time() - started, 1)}
+        try:
+            async with session.get(f"{args.api}/metrics") as response:
+                for name, value in METRIC_LINE.findall(await response.text()):
+                    sample[f"metrics_{name}"] = float(value)
+        except Exception:
+            pass
+        if args.server_pid:
+            sample["proc_rss_bytes"], sample["proc_open_fds"] = read_proc(args.server_pid)
+        timeline.append(sample)
+        await asyncio.sleep(args.sample_interval)
+
+
+async def cast_votes(session: aiohttp.ClientSession, args, battle, sent_at: Dict[int, float], outcomes: Counter) -> None:
+    """Vote at --vote-rate from fresh devices, noting when each tally version was caused."""
+    interval = 1 / args.vote_rate
+    rng = random.Random(args.seed)
+    n = 0
+    next_at = time.perf_counter()
+    in_flight = set()
+
+    async def vote(i: int) -> None:
+        sent = time.time()
+        try:
+            async with session.post(
+                f"{args.api}/vote",
+                json={"battle_id": battle.battle_id, "choice": "A" if rng.random() < 0.55 else "B",
+                      "device_hash": f"soak-{args.seed}-{i}"},
+                headers={"Authorization": f"Bearer {battle.token}",
+                         "X-Forwarded-For": f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}"},
+            ) as response:
+                outcomes[str(response.status)] += 1
+                if response.status == 200:
+                    version = (await response.json()).get("tally", {}).get("version")
+                    if version is not None:
+                        sent_at[version] = sent
+        except Exception as e:
+            outcomes[type(e).__name__] += 1
+
+    while True:
+        task = asyncio.create_task(vote(n))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+        n += 1
+        next_at += interval
+        await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+
+
+def delivery_latencies(deliveries: List[Tuple[int, float]], sent_at: Dict[int, float]) -> List[float]:
+    """Receipt time minus send time of the vote that produced each version."""
+    return [received - sent_at[version] for version, received in deliveries if version in sent_at]
+
+
+async def main_async(args) -> Dict:
+    raise_fd_limit()
+    timeout = aiohttp.ClientTimeout(total=30)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        battle = await provision_battle(
+            session, args.api, args.admin_key, "soak test", rate_limits={"ip": 0, "device": 0}
+        )
+        started = time.time()
+        args.deadline = started + args.ramp + args.duration
+        timeline: list = []
+        sent_at: Dict[int, float] = {}
+        vote_outcomes: Counter = Counter()
+        try:
+            sampler = asyncio.create_task(sample_server(session, args, started, timeline))
+            # Fresh interpreters: nothing of this process's event loop or sockets
+            context = multiprocessing.get_context("spawn")
+            results = context.Queue()
+            processes = [
+                context.Process(
+                    target=client_process, args=(args, battle.battle_id, worker, n_sse, n_pollers, results)
+                )
+                for worker, (n_sse, n_pollers) in enumerate(
+                    zip(split(args.sse, args.processes), split(args.pollers, args.processes))
+                )
+            ]
+            for process in processes:
+                process.start()
+            print(f"Ramping {args.sse} SSE clients and {args.pollers} pollers over {args.ramp}s "
+                  f"in {args.processes} processes, then {args.duration}s at {args.vote_rate} votes/s",
+                  file=sys.stderr)
+            voter = asyncio.create_task(cast_votes(session, args, battle, sent_at, vote_outcomes))
+            loop = asyncio.get_running_loop()
+            wait = functools.partial(results.get, timeout=args.deadline - time.time() + 120)
+            reports = [await loop.run_in_executor(None, wait) for _ in processes]
+            voter.cancel()
+            sampler.cancel()
+            await asyncio.gather(voter, sampler, return_exceptions=True)
+            for process in processes:
+                process.join()
+        finally:
+            if not args.keep:
+                await delete_event(session, args.api, args.admin_key, battle.event_id)
+
+    def total(key: str) -> Counter:
+        combined: Counter = Counter()
+        for report in reports:
+            combined.update(report[key])
+        return combined
+
+    sse_latencies = delivery_latencies([d for r in reports for d in r["sse_deliveries"]], sent_at)
+    poll_latencies = delivery_latencies([d for r in reports for d in r["poll_deliveries"]], sent_at)
+    opened = sum(report["opened"] for report in reports)
+
+    def peak(key: str) -> Optional[float]:
+        values = [sample[key] for sample in timeline if key in sample]
+        return max(values) if values else None
+
+    baseline = timeline[0] if timeline else {}
+    peak_rss = peak("proc_rss_bytes") or peak("metrics_process_resident_memory_bytes")
+    base_rss = baseline.get("proc_rss_bytes") or baseline.get("metrics_process_resident_memory_bytes")
+    clients = args.sse + args.pollers
+
+    return {
+        "config": {
+            "api": args.api, "sse": args.sse, "pollers": args.pollers, "poll_interval": args.poll_interval,
+            "vote_rate": args.vote_rate, "duration": args.duration, "ramp": args.ramp,
+            "processes": args.processes, "reconnect": args.reconnect, "seed": args.seed,
+        },
+        "votes": {"sent": sum(vote_outcomes.values()), "outcomes": dict(vote_outcomes)},
+        "sse": {
+            "opened": opened,
+            "failed_to_open": dict(total("open_failures")),
+            "dropped": dict(total("drops")),
+            "messages": sum(report["messages"] for report in reports),
+            "heartbeats": sum(report["heartbeats"] for report in reports),
+            "deliveries_seen": sum(report["sse_deliveries_seen"] for report in reports),
+            "delivery_latency_ms": percentiles(sse_latencies),
+        },
+        "polling": {
+            "responses": dict(total("poll_statuses")),
+            "request_ms": percentiles([d for r in reports for d in r["poll_durations"]]),
+            "delivery_latency_ms": percentiles(poll_latencies),
+        },
+        "server": {
+            "peak_rss_bytes": peak_rss,
+            "peak_open_fds": peak("proc_open_fds") or peak("metrics_process_open_fds"),
+            "peak_sse_streams_reported": peak("metrics_sse_streams"),
+            "rss_bytes_per_client": round((peak_rss - base_rss) / clients) if peak_rss and base_rss and clients else None,
+            "timeline": timeline,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--api", default="http://localhost:8000")
+    parser.add_argument("--admin-key", default="change-me")
+    parser.add_argument("--sse", type=int, default=1000, help="SSE clients")
+    parser.add_argument("--pollers", type=int, default=0, help="polling clients")
+    parser.add_argument("--poll-interval", type=float, default=2.0)
+    parser.add_argument("--vote-rate", type=float, default=10.0, help="votes per second during the soak")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds to hold every client after the ramp")
+    parser.add_argument("--ramp", type=float, default=10.0, help="seconds over which clients connect")
+    parser.add_argument("--processes", type=int, default=1, help="client processes to spread viewers over")
+    parser.add_argument("--reconnect", action=argparse.BooleanOptionalAction, default=True,
+                        help="reconnect dropped streams with Last-Event-ID like EventSource")
+    parser.add_argument("--retry", type=float, default=3.0, help="seconds before reconnecting")
+    parser.add_argument("--server-pid", type=int, action="append", help="API (master) pid to read /proc for")
+    parser.add_argument("--sample-interval", type=float, default=1.0)
+    parser.add_argument("--reservoir", type=int, default=100000, help="latency samples kept per process")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--keep", action="store_true", help="leave the provisioned event in place")
+    parser.add_argument("-o", "--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    report = asyncio.run(main_async(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+        sse = report["sse"]
+        print(f"SSE opened {sse['opened']}/{args.sse}, dropped {sse['dropped']}, "
+              f"delivery {sse['delivery_latency_ms']}; polling {report['polling']['delivery_latency_ms']}; "
+              f"peak RSS {report['server']['peak_rss_bytes']}, fds {report['server']['peak_open_fds']}",
+              file=sys.stderr)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -60,6 +60,11 @@ export class ApiClient {
     return this.request(`/tallies/${battleId}`);
   }
 
+  // Long-poll: resolves once the tally moves past `since` (or after the server timeout)
+  async waitForTallies(battleId: string, since: number): Promise<Tally> {
+    return this.request(`/tallies/${battleId}?since=${since}`);
+  }
+
   // Get battle details
   async getBattle(battleId: string): Promise<Battle> {
     return this.request(`/battles/${battleId}`);
@@ -152,8 +157,19 @@ export class ApiClient {
     });
   }
 
-  // SSE for live updates
+  // SSE for live updates: tallies as messages, plus named `status` events; resumes after reconnects
   createSSEConnection(battleId: string): EventSource {
     return new EventSource(`${this.baseUrl}/sse/battles/${battleId}`);
   }
+
+  // Every battle of an event on one stream: named `status` and `tally` events
+  createEventSSEConnection(eventId: string): EventSource {
+    return new EventSource(`${this.baseUrl}/sse/events/${eventId}`);
+  }
+
+  // One socket for voting and live tallies; send {type: 'vote', choice, device_hash, id}
+  createVoteSocket(battleId: string, eventToken: string): WebSocket {
+    const wsBase = this.baseUrl.replace(/^http/, 'ws');
+    return new WebSocket(`${wsBase}/ws/battles/${battleId}?token=${encodeURIComponent(eventToken)}`);
+  }
 }
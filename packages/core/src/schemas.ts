@@ -42,6 +42,7 @@ export const TallySchema = z.object({
   A: z.number(),
   B: z.number(),
   REPLICA: z.number(),
+  version: z.number().nullable().optional(),
 });
 export type Tally = z.infer<typeof TallySchema>;
 